@@ -75,6 +75,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "config.wsgi.application"
+ASGI_APPLICATION = "config.asgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -191,9 +192,79 @@ PASSWORD_RESET_TIMEOUT_DAYS = 1
 #     }
 # }
 
+# Общий для всех процессов кэш. Для кэша в БД:
+# CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache, CACHE_LOCATION=mailing_cache
+# и один раз manage.py createcachetable
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND') or 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION') or str(BASE_DIR / 'cache'),
+    }
+}
+
 CACHE_MIDDLEWARE_SECONDS = 300
 CACHE_MIDDLEWARE_KEY_PREFIX = 'django_'
 STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
 STATICFILES_CACHE_TIMEOUT = 86400
 
 # CACHE_TIMEOUT = 300
+
+# Очередь отправки рассылок (manage.py run_delivery_worker)
+MAILING_WORKER_POLL_INTERVAL = 5
+# Сколько писем отправляется через одно SMTP-соединение
+MAILING_BATCH_SIZE = 100
+# Параллельные SMTP-соединения: на одну рассылку и на весь процесс воркера
+MAILING_MAX_CONNECTIONS = 4
+MAILING_GLOBAL_MAX_CONNECTIONS = 16
+# Сколько попыток доставки писать в БД одним INSERT
+MAILING_ATTEMPT_BATCH_SIZE = 500
+# Кэш статистики: ключи по пользователю и роли, сброс по версии владельца при записи попыток
+MAILING_STATISTICS_CACHE = 'default'
+MAILING_STATISTICS_CACHE_TIMEOUT = 300
+# Постраничный вывод списков (курсор по owner_id, id)
+MAILING_PAGE_SIZE = 24
+MAILING_MAX_PAGE_SIZE = 200
+# Импорт получателей из CSV: строк в одном INSERT ... ON CONFLICT
+MAILING_IMPORT_BATCH_SIZE = 1000
+# Выгрузка истории доставки: строк на одну выборку серверного курсора
+MAILING_EXPORT_CHUNK_SIZE = 2000
+# Планировщик (manage.py run_scheduler): максимальная пауза между проходами, сек.
+MAILING_SCHEDULER_INTERVAL = 30
+# Секционирование истории доставки (PostgreSQL): секций вперёд и срок хранения в месяцах
+MAILING_ATTEMPT_PARTITIONS_AHEAD = 2
+MAILING_ATTEMPT_RETENTION_MONTHS = 12
+# Лимит скорости отправки: (писем в секунду > 0, запас на всплеск >= 1) на SMTP-сервер и на владельца рассылки;
+# None — без лимита. Вёдра токенов общие для всех воркеров (таблица RateLimitBucket), для одного
+# процесса без БД — mailing.ratelimit.LocalRateLimiter
+MAILING_RATE_LIMITER = 'mailing.ratelimit.DatabaseRateLimiter'
+MAILING_HOST_RATE_LIMIT = None
+MAILING_OWNER_RATE_LIMIT = None
+# Сколько токенов поток отправки берёт у ограничителя за одно обращение
+MAILING_RATE_LIMIT_GRANT = 10
+# Повтор при временных ошибках SMTP (4xx, обрыв, таймаут): всего попыток на получателя и паузы, сек.
+# Пауза перед n-й попыткой — BASE_DELAY * 2^(n-2), не больше MAX_DELAY, со случайным разбросом
+MAILING_RETRY_MAX_ATTEMPTS = 5
+MAILING_RETRY_BASE_DELAY = 60
+MAILING_RETRY_MAX_DELAY = 3600
+# Задача «выполняется», но воркер не отмечался дольше стольких секунд — возвращается в очередь
+MAILING_JOB_STALE_TIMEOUT = 600
+# Сколько скомпилированных шаблонов сообщений (подстановки {{ full_name }}, {{ email }}) держать в памяти процесса
+MAILING_TEMPLATE_CACHE_SIZE = 256
+# Ход отправки (mailing/<pk>/progress/): снимок счётчиков в кэше статистики, сбрасывается при записи пачки;
+# таймаут ограничивает устаревание статуса рассылки, сек.
+MAILING_PROGRESS_CACHE_TIMEOUT = 5
+# События доставки для SSE (mailing/<pk>/events/): канал LISTEN/NOTIFY в PostgreSQL, интервал keepalive
+# и пауза перед переподключением слушателя, сек.
+MAILING_EVENTS_CHANNEL = 'mailing_events'
+MAILING_EVENTS_KEEPALIVE = 15
+MAILING_EVENTS_RECONNECT_DELAY = 5
+# Движок отправки: пул потоков с соединением на поток (mailing.delivery.deliver_parallel) или asyncio —
+# все SMTP-сессии в одном потоке (mailing.async_delivery.deliver_async, нужен aiosmtplib)
+MAILING_DELIVERY_ENGINE = 'mailing.delivery.deliver_parallel'
+# Одновременных SMTP-сессий на рассылку у движка asyncio
+MAILING_ASYNC_MAX_CONNECTIONS = 32
+# Шарды отправки: получателей в одной задаче очереди; шарды рассылки забирают воркеры на любых узлах
+MAILING_SHARD_SIZE = 50000
+# Как часто воркер продлевает аренду выполняемой задачи (heartbeat), сек.: заметно меньше MAILING_JOB_STALE_TIMEOUT,
+# чтобы медленный SMTP или ожидание лимита отправки не делали задачу зависшей
+MAILING_JOB_HEARTBEAT_INTERVAL = 60
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.shortcuts import redirect
 from django.urls import path
 from django.utils.html import format_html
-from .models import Mailing, MailingStatistics, send_mailing
+from .models import Mailing, MailingCounters, DeliveryJob, DeliveryState, RateLimitBucket, SuppressedAddress
+from .tasks import send_mailing_task
 
 
 @admin.register(Mailing)
@@ -25,13 +26,46 @@ class MailingAdmin(admin.ModelAdmin):
 
     def send_mailing_view(self, request, pk):
         mailing = Mailing.objects.get(pk=pk)
-        send_mailing(mailing)
-        self.message_user(request, f"Рассылка {mailing.subject} запущена!")
+        send_mailing_task(mailing.pk)
+        self.message_user(request, f"Рассылка {mailing.subject} поставлена в очередь!")
         return redirect('admin:mailing_mailing_changelist')
 
+    @admin.action(description="Отправить выбранные рассылки")
+    def send_mailing(self, request, queryset):
+        for mailing in queryset:
+            send_mailing_task(mailing.pk)
+        self.message_user(request, f"Рассылок поставлено в очередь: {len(queryset)}")
 
-@admin.register(MailingStatistics)
-class MailingStatisticsAdmin(admin.ModelAdmin):
-    list_display = ("mailing", "recipient", "sent_at", "status")
-    list_filter = ("status", "sent_at")
-    search_fields = ("recipient", "mailing__id")
+
+@admin.register(MailingCounters)
+class MailingCountersAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "total_attempts", "successful_attempts", "failed_attempts", "updated_at")
+
+
+@admin.register(DeliveryJob)
+class DeliveryJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "mailing", "kind", "status", "range_start", "range_end", "processed", "recipients_total",
+                    "attempt_number", "run_after", "created_at", "finished_at", "worker")
+    list_filter = ("kind", "status")
+    search_fields = ("mailing__id",)
+
+
+@admin.register(DeliveryState)
+class DeliveryStateAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "recipient", "status", "attempt_number", "updated_at")
+    list_filter = ("status",)
+    search_fields = ("mailing__id", "recipient__email")
+    raw_id_fields = ("mailing", "recipient")
+
+
+@admin.register(RateLimitBucket)
+class RateLimitBucketAdmin(admin.ModelAdmin):
+    list_display = ("key", "tokens", "updated_at")
+    search_fields = ("key",)
+
+
+@admin.register(SuppressedAddress)
+class SuppressedAddressAdmin(admin.ModelAdmin):
+    list_display = ("email", "reason", "comment", "created_at")
+    list_filter = ("reason",)
+    search_fields = ("email",)
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import queue
+import re
+import smtplib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+from django.db import connections
+
+from .delivery import EmailFactory, chunked, connection_slots, failure_status, message_date
+from .personalization import compiled_message
+from .ratelimit import Throttle, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Пауза между попытками занять слот общего лимита SMTP-соединений, сек.
+SLOT_POLL_INTERVAL = 0.05
+
+# Адрес без имени, пробелов и спецсимволов: sanitize_address вернул бы его без изменений
+PLAIN_ADDRESS_RE = re.compile(r'[^@\s<>()\[\],;:"\\]+@[^@\s<>()\[\],;:"\\]+\Z', re.ASCII)
+
+
+def import_aiosmtplib():
+    try:
+        import aiosmtplib
+    except ImportError:
+        raise ImproperlyConfigured("Для движка отправки на asyncio нужен aiosmtplib: poetry install -E async")
+    return aiosmtplib
+
+
+def envelope_address(address, encoding):
+    # Полный разбор адреса (sanitize_address) заметно дороже отправки команды — обычные адреса не разбираем
+    if address.isascii() and PLAIN_ADDRESS_RE.match(address):
+        return address
+    return sanitize_address(address, encoding)
+
+
+def as_smtplib_error(aiosmtplib, error):
+    """Ошибка aiosmtplib в виде ошибки smtplib: классификация (failure_status) у движков общая.
+
+    Обрывы и таймауты aiosmtplib — уже OSError и временные без преобразования.
+    """
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return smtplib.SMTPRecipientsRefused({
+            refused.recipient: (refused.code, refused.message.encode()) for refused in error.recipients
+        })
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return smtplib.SMTPResponseException(error.code, error.message.encode())
+    return error
+
+
+class AsyncSender:
+    """SMTP-сессии одного прохода рассылки в цикле asyncio.
+
+    Каждая сессия держит своё соединение открытым и забирает пачки из общей очереди, пока они не
+    кончатся. Токены лимита отправки берутся в отдельном потоке: ограничитель ходит в БД и ждёт.
+    """
+
+    def __init__(self, aiosmtplib, emails, limits=None):
+        self.aiosmtplib = aiosmtplib
+        self.emails = emails
+        self.limits = limits
+        self.limiter_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smtp-ratelimit')
+        # Отправитель у всех писем прохода один — его адрес разбираем один раз
+        self.senders = {}
+
+    def client(self):
+        username = settings.EMAIL_HOST_USER or None
+        password = settings.EMAIL_HOST_PASSWORD or None
+        return self.aiosmtplib.SMTP(
+            hostname=settings.EMAIL_HOST,
+            port=int(settings.EMAIL_PORT) if settings.EMAIL_PORT else None,
+            username=username if password else None,
+            password=password if username else None,
+            use_tls=settings.EMAIL_USE_SSL,
+            start_tls=settings.EMAIL_USE_TLS,
+            timeout=settings.EMAIL_TIMEOUT,
+            local_hostname=DNS_NAME.get_fqdn(),
+        )
+
+    async def send(self, smtp, email):
+        encoding = email.encoding or settings.DEFAULT_CHARSET
+        sender = self.senders.get(email.from_email)
+        if sender is None:
+            sender = self.senders[email.from_email] = sanitize_address(email.from_email, encoding)
+        await smtp.sendmail(
+            sender,
+            [envelope_address(address, encoding) for address in email.recipients()],
+            email.message().as_bytes(linesep='\r\n'),
+        )
+
+    async def reconnect(self, smtp):
+        smtp.close()
+        await smtp.connect()
+
+    async def take_token(self, throttle, remaining):
+        if not throttle.take():
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.limiter_executor, throttle.wait, remaining)
+
+    async def send_chunk(self, smtp, recipients, throttle):
+        results = []
+        date = message_date()
+        for position, recipient in enumerate(recipients):
+            email = self.emails.build(recipient, date)
+            if throttle is not None:
+                await self.take_token(throttle, len(recipients) - position)
+            try:
+                try:
+                    await self.send(smtp, email)
+                except self.aiosmtplib.SMTPServerDisconnected as e:
+                    logger.warning(f"SMTP-сервер разорвал соединение ({str(e)}), переподключаемся")
+                    await self.reconnect(smtp)
+                    await self.send(smtp, email)
+                results.append((recipient, 'success', 'Email sent successfully'))
+            except Exception as e:
+                logger.error(f"Ошибка для {recipient.email}: {str(e)}")
+                results.append((recipient, failure_status(as_smtplib_error(self.aiosmtplib, e)), str(e)))
+        return results
+
+    async def take_slot(self, slots):
+        # Семафор потоков (connection_slots) нельзя ждать в цикле событий — опрашиваем без блокировки.
+        # Отмена во время ожидания ничего не захватывает, поэтому слот не теряется
+        while not slots.acquire(blocking=False):
+            await asyncio.sleep(SLOT_POLL_INTERVAL)
+
+    async def session(self, chunks, publish):
+        # Соединение сессии занимает слот общего на процесс лимита MAILING_GLOBAL_MAX_CONNECTIONS,
+        # как и соединение пачки у пула потоков
+        slots = connection_slots()
+        await self.take_slot(slots)
+        try:
+            await self.send_chunks(chunks, publish)
+        finally:
+            slots.release()
+
+    async def send_chunks(self, chunks, publish):
+        throttle = Throttle(get_rate_limiter(), self.limits) if self.limits else None
+        smtp = self.client()
+        try:
+            while chunks:
+                recipients = chunks.popleft()
+                if not smtp.is_connected:
+                    try:
+                        await smtp.connect()
+                    except Exception as e:
+                        logger.error(f"Не удалось подключиться к SMTP-серверу: {str(e)}")
+                        error = as_smtplib_error(self.aiosmtplib, e)
+                        publish([(recipient, failure_status(error), str(e)) for recipient in recipients])
+                        continue
+                publish(await self.send_chunk(smtp, recipients, throttle))
+        finally:
+            if smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except self.aiosmtplib.SMTPException:
+                    smtp.close()
+
+    async def run(self, chunks, sessions, publish):
+        chunks = deque(chunks)
+        try:
+            await asyncio.gather(*(self.session(chunks, publish) for _ in range(sessions)))
+        finally:
+            # Поток ограничителя мог открыть соединение с БД — закрываем его там же
+            if self.limits:
+                await asyncio.get_running_loop().run_in_executor(self.limiter_executor, connections.close_all)
+            self.limiter_executor.shutdown()
+
+
+def deliver_async(message, recipients, max_connections=None, batch_size=None, limits=None):
+    """Движок отправки на asyncio (aiosmtplib): все SMTP-сессии в одном потоке, без потока на соединение.
+
+    Замена deliver_parallel: отдаёт результаты пачек по мере готовности (порядок пачек не сохраняется).
+    Цикл событий работает в своём потоке, так что пока вызывающий пишет пачку в БД, отправка идёт дальше.
+    """
+    aiosmtplib = import_aiosmtplib()
+    batch_size = batch_size or settings.MAILING_BATCH_SIZE
+    max_connections = max_connections or settings.MAILING_ASYNC_MAX_CONNECTIONS
+    chunks = list(chunked(recipients, batch_size))
+    if not chunks:
+        return
+    sender = AsyncSender(aiosmtplib, EmailFactory(compiled_message(message)), limits)
+    results = queue.Queue()
+    loop = asyncio.new_event_loop()
+    sessions = min(max_connections, settings.MAILING_GLOBAL_MAX_CONNECTIONS, len(chunks))
+    task = loop.create_task(sender.run(chunks, sessions, results.put))
+
+    def run_loop():
+        try:
+            loop.run_until_complete(task)
+        except BaseException as e:
+            # Ошибку движка поднимаем в потоке вызывающего, иначе он ждал бы пачки вечно
+            results.put(e)
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=run_loop, name='smtp-asyncio', daemon=True)
+    thread.start()
+    try:
+        for _ in chunks:
+            chunk_results = results.get()
+            if isinstance(chunk_results, BaseException):
+                raise chunk_results
+            yield chunk_results
+    finally:
+        # Вызывающий мог остановиться раньше (ошибка записи в БД) — отменяем оставшиеся сессии
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # Цикл уже закрыт: все пачки отправлены
+            pass
+        thread.join()
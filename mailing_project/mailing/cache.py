@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.cache import caches
+
+# Версия «все владельцы» — её видят менеджеры, сбрасывается при любой записи
+ALL_OWNERS = 'all'
+
+
+def statistics_cache():
+    return caches[settings.MAILING_STATISTICS_CACHE]
+
+
+def _version_key(owner_id):
+    return f"mailing:stats:version:{owner_id}"
+
+
+def get_version(owner_id):
+    return statistics_cache().get_or_set(_version_key(owner_id), 1, None)
+
+
+def bump_versions(owner_ids):
+    """Инвалидирует статистику владельцев: старые ключи просто перестают читаться и истекают сами."""
+    cache = statistics_cache()
+    for owner_id in {*owner_ids, ALL_OWNERS}:
+        try:
+            cache.incr(_version_key(owner_id))
+        except ValueError:
+            cache.set(_version_key(owner_id), 2, None)
+
+
+def cache_key(user, name, *parts):
+    # Менеджеры видят одинаковые данные и делят записи; пользователь видит только своё
+    if user.is_manager():
+        scope = f"manager:v{get_version(ALL_OWNERS)}"
+    else:
+        scope = f"user:{user.pk}:v{get_version(user.pk)}"
+    return ':'.join(['mailing:stats', name, scope, *map(str, parts)])
+
+
+def get_or_build(user, name, build, *parts):
+    """Возвращает данные статистики из кэша или строит их и кладёт в кэш."""
+    key = cache_key(user, name, *parts)
+    cache = statistics_cache()
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.MAILING_STATISTICS_CACHE_TIMEOUT)
+    return data
+
+
+def _progress_key(mailing_id):
+    return f"mailing:progress:{mailing_id}"
+
+
+def get_progress_snapshot(mailing_id, build):
+    """Снимок счётчиков рассылки для опроса хода отправки; живёт до следующей записанной пачки."""
+    cache = statistics_cache()
+    key = _progress_key(mailing_id)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build(mailing_id)
+        if snapshot is not None:
+            cache.set(key, snapshot, settings.MAILING_PROGRESS_CACHE_TIMEOUT)
+    return snapshot
+
+
+def reset_progress(mailing_ids):
+    statistics_cache().delete_many([_progress_key(mailing_id) for mailing_id in mailing_ids])
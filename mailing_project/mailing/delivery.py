@@ -0,0 +1,426 @@
+import logging
+import smtplib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+
+from django.conf import settings
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.core.mail.message import make_msgid, sanitize_address
+from django.core.mail.utils import DNS_NAME
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+from .cache import bump_versions, reset_progress
+from .events import publish
+from .models import DeliveryAttempt, DeliveryState, MailingCounters
+from .personalization import compiled_message
+from .ratelimit import Throttle, get_rate_limiter, mailing_limits
+from .statistics import current_progress
+from .suppression import SuppressionList, normalize_email, suppress_addresses
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых сервер закрыл соединение и письмо можно повторить на новом
+DISCONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+_connection_slots = None
+_connection_slots_lock = threading.Lock()
+
+
+def is_transient(error):
+    """Временная ли ошибка SMTP: 4xx (greylisting, перегрузка) и обрывы сети — да, 5xx и прочее — нет."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, message in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # SMTPException — подкласс OSError; остальные OSError — сеть и таймауты, адрес ни при чём
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def is_hard_bounce(error):
+    # Сервер отверг сам адрес (5xx на RCPT TO) — писать на него дальше бессмысленно
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, message in error.recipients.values()]
+        return bool(codes) and all(500 <= code < 600 for code in codes)
+    return False
+
+
+def failure_status(error):
+    # deferred — попытка не удалась, но получателя стоит повторить позже;
+    # bounced — окончательный отказ по адресу, записывается как failed и блокирует адрес
+    if is_hard_bounce(error):
+        return 'bounced'
+    return 'deferred' if is_transient(error) else 'failed'
+
+
+def connection_slots():
+    """Общий на процесс семафор: не больше MAILING_GLOBAL_MAX_CONNECTIONS SMTP-соединений сразу."""
+    global _connection_slots
+    with _connection_slots_lock:
+        if _connection_slots is None:
+            _connection_slots = threading.BoundedSemaphore(settings.MAILING_GLOBAL_MAX_CONNECTIONS)
+    return _connection_slots
+
+
+class AttemptBuffer:
+    """Копит результаты доставки в памяти и пишет их в БД пачками через bulk_create.
+
+    Вместе с попытками в той же транзакции обновляется DeliveryState получателей, поэтому после
+    падения процесса заново уйдут только письма из последней незаписанной пачки.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.MAILING_ATTEMPT_BATCH_SIZE
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Пишем накопленное и при ошибке/остановке воркера, чтобы не потерять уже отправленное
+        self.flush()
+
+    def add(self, mailing, recipient, status, response=None, attempt_number=1):
+        self.pending.append(DeliveryAttempt(
+            mailing=mailing,
+            recipient=recipient,
+            status=status,
+            server_response=response,
+            attempt_number=attempt_number,
+        ))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return 0
+        attempts, self.pending = self.pending, []
+        # Отложенные попытки в счётчики не попадают: счётчики — это итог по получателю
+        outcomes = Counter((attempt.mailing_id, attempt.status) for attempt in attempts
+                           if attempt.status != 'deferred')
+        with transaction.atomic():
+            DeliveryAttempt.objects.bulk_create(attempts, batch_size=self.batch_size)
+            save_states(attempts, self.batch_size)
+            for mailing_id in {mailing_id for mailing_id, status in outcomes}:
+                MailingCounters.increment(
+                    mailing_id,
+                    successful=outcomes[(mailing_id, 'success')],
+                    failed=outcomes[(mailing_id, 'failed')],
+                    suppressed=outcomes[(mailing_id, 'suppressed')],
+                )
+        bump_versions({attempt.mailing.owner_id for attempt in attempts})
+        reset_progress({attempt.mailing_id for attempt in attempts})
+        logger.info(f"Записано попыток доставки: {len(attempts)}")
+        return len(attempts)
+
+
+def save_states(attempts, batch_size):
+    # Одна строка на (рассылка, получатель): последняя попытка перезаписывает предыдущую
+    latest = {(attempt.mailing_id, attempt.recipient_id): attempt for attempt in attempts}
+    DeliveryState.objects.bulk_create(
+        [DeliveryState(mailing_id=attempt.mailing_id, recipient_id=attempt.recipient_id, status=attempt.status,
+                       attempt_number=attempt.attempt_number, updated_at=attempt.attempt_time)
+         for attempt in latest.values()],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['mailing', 'recipient'],
+        update_fields=['status', 'attempt_number', 'updated_at'],
+    )
+
+
+def pending_recipients(mailing, recipient_ids=None, recipient_range=None):
+    """Получатели рассылки без окончательного итога (одним запросом с NOT IN по DeliveryState).
+
+    recipient_range — (начало, конец) диапазона id шарда, None с любой стороны — без границы.
+    """
+    recipients = mailing.recipients.exclude(
+        pk__in=DeliveryState.objects.filter(mailing=mailing, status__in=DeliveryState.FINAL_STATUSES)
+                                    .values('recipient_id'))
+    if recipient_ids is not None:
+        recipients = recipients.filter(pk__in=recipient_ids)
+    if recipient_range is not None:
+        start, end = recipient_range
+        if start is not None:
+            recipients = recipients.filter(pk__gte=start)
+        if end is not None:
+            recipients = recipients.filter(pk__lt=end)
+    return recipients.order_by('pk')
+
+
+def split_suppressed(recipients, suppression):
+    """Делит получателей на тех, кому отправляем, и пропущенных: адрес заблокирован или уже встречался."""
+    to_send, skipped, seen = [], [], set()
+    for recipient in recipients:
+        email = normalize_email(recipient.email)
+        if email in suppression:
+            skipped.append((recipient, "Адрес в списке подавления"))
+        elif email in seen:
+            skipped.append((recipient, "Адрес повторяется в рассылке"))
+        else:
+            seen.add(email)
+            to_send.append(recipient)
+    return to_send, skipped
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def compose_email(subject, body, html, to):
+    email = EmailMultiAlternatives(subject, body, settings.DEFAULT_FROM_EMAIL, to)
+    if html:
+        email.attach_alternative(html, 'text/html')
+    return email
+
+
+def header_bytes(msg, linesep, headers=None):
+    # Заголовки так же, как их пишет BytesGenerator; headers — только эти, а не все заголовки msg
+    policy = msg.policy.clone(linesep=linesep)
+    if headers is None:
+        headers = msg.items()
+    return b''.join(policy.fold_binary(name, value) for name, value in headers)
+
+
+def message_date():
+    # Заголовок Date, как его ставит EmailMessage.message()
+    return formatdate(localtime=settings.EMAIL_USE_LOCALTIME)
+
+
+class PreparedMessage:
+    """MIME письма получателя: свои только To, Date и Message-ID, остальные заголовки и части письма — общий
+    корень фабрики, их байты уже готовы."""
+
+    def __init__(self, factory, headers):
+        self.factory = factory
+        self.headers = headers
+
+    def __getattr__(self, name):
+        return getattr(self.factory.mime, name)
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def get(self, name, failobj=None):
+        for key, value in self.headers:
+            if key.lower() == name.lower():
+                return value
+        return self.factory.mime.get(name, failobj)
+
+    def items(self):
+        return self.factory.mime.items() + self.headers
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        own = header_bytes(self.factory.mime, linesep, self.headers)
+        return self.factory.common_header_bytes(linesep) + own + self.factory.body_bytes(linesep)
+
+
+class PreparedEmail(EmailMessage):
+    """Письмо поверх заранее собранного MIME: message() добавляет к общему корню только To, Date и Message-ID."""
+
+    def __init__(self, factory, to, date):
+        source = factory.source
+        super().__init__(source.subject, source.body, source.from_email, [to])
+        self.alternatives = source.alternatives
+        self.factory = factory
+        self.date = date
+
+    def message(self):
+        # Как SafeMIMEMessage при msg['To'] = ...: домен в punycode, имя — encoded-word, а не весь адрес целиком
+        to = sanitize_address(self.to[0], self.encoding or settings.DEFAULT_CHARSET)
+        return PreparedMessage(self.factory, [('To', to), ('Date', self.date),
+                                              ('Message-ID', make_msgid(domain=DNS_NAME))])
+
+
+class EmailFactory:
+    """Письма одного прохода рассылки.
+
+    Если в сообщении нет подстановок, MIME (кодирование текста и HTML, граница multipart) собирается
+    и сериализуется один раз, общие заголовки — тоже, а на получателя формируются только To, Date и Message-ID.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.source = self.mime = None
+        self._body_bytes = {}
+        self._header_bytes = {}
+        if template.is_static:
+            self.source = compose_email(template.subject.source, template.body.source, template.html_body.source, [])
+            self.mime = self.source.message()
+            # Сериализация выбирает границу multipart и сохраняет её в общем корне (заголовок Content-Type)
+            self.body_bytes('\r\n')
+            # Date и Message-ID у каждого письма свои (PreparedEmail), в общем корне их нет
+            del self.mime['Date']
+            del self.mime['Message-ID']
+
+    def body_bytes(self, linesep):
+        """Всё после заголовков (пустая строка и части письма) в байтах — один раз на разделитель строк."""
+        body = self._body_bytes.get(linesep)
+        if body is None:
+            body = self.mime.as_bytes(linesep=linesep)[len(header_bytes(self.mime, linesep)):]
+            self._body_bytes[linesep] = body
+        return body
+
+    def common_header_bytes(self, linesep):
+        headers = self._header_bytes.get(linesep)
+        if headers is None:
+            headers = header_bytes(self.mime, linesep)
+            self._header_bytes[linesep] = headers
+        return headers
+
+    def build(self, recipient, date=None):
+        """Письмо получателю; date — заголовок Date, общий для пачки (по умолчанию — текущее время)."""
+        if self.mime is None:
+            return compose_email(*self.template.render(recipient), [recipient.email])
+        return PreparedEmail(self, recipient.email, date or message_date())
+
+
+def close_connection(connection):
+    try:
+        connection.close()
+    except Exception as e:
+        logger.warning(f"Ошибка при закрытии SMTP-соединения: {str(e)}")
+
+
+def send_chunk(connection, emails, recipients, throttle=None):
+    """Отправляет пачку писем через одно открытое соединение, переподключаясь при обрыве.
+
+    throttle (ratelimit.Throttle) придерживает отправку, пока в вёдрах лимита нет токена.
+    """
+    results = []
+    # Письма пачки уходят одно за другим — дата у них общая, а не с момента сборки MIME прохода
+    date = message_date()
+    for position, recipient in enumerate(recipients):
+        email = emails.build(recipient, date)
+        if throttle is not None:
+            throttle.wait(len(recipients) - position)
+        try:
+            try:
+                connection.send_messages([email])
+            except DISCONNECT_ERRORS as e:
+                logger.warning(f"SMTP-сервер разорвал соединение ({str(e)}), переподключаемся")
+                close_connection(connection)
+                connection.open()
+                connection.send_messages([email])
+            results.append((recipient, 'success', 'Email sent successfully'))
+        except Exception as e:
+            logger.error(f"Ошибка для {recipient.email}: {str(e)}")
+            results.append((recipient, failure_status(e), str(e)))
+    return results
+
+
+def deliver_chunk(emails, recipients, limits=None):
+    # Выполняется в потоке пула: у каждой пачки своё соединение. К БД поток обращается только
+    # за токенами лимита отправки и закрывает своё соединение с ней в конце
+    throttle = Throttle(get_rate_limiter(), limits) if limits else None
+    try:
+        return _deliver_chunk(emails, recipients, throttle)
+    finally:
+        if throttle is not None:
+            connections.close_all()
+
+
+def _deliver_chunk(emails, recipients, throttle):
+    with connection_slots():
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as e:
+            logger.error(f"Не удалось подключиться к SMTP-серверу: {str(e)}")
+            return [(recipient, failure_status(e), str(e)) for recipient in recipients]
+        try:
+            return send_chunk(connection, emails, recipients, throttle)
+        finally:
+            close_connection(connection)
+
+
+def deliver_parallel(message, recipients, max_connections=None, batch_size=None, limits=None):
+    """Раздаёт пачки получателей пулу потоков и отдаёт результаты пачек по мере готовности, в исходном порядке."""
+    batch_size = batch_size or settings.MAILING_BATCH_SIZE
+    max_connections = max_connections or settings.MAILING_MAX_CONNECTIONS
+    chunks = list(chunked(recipients, batch_size))
+    if not chunks:
+        return
+    # Шаблон разбирается (а MIME без подстановок собирается) один раз на проход
+    emails = EmailFactory(compiled_message(message))
+    with ThreadPoolExecutor(max_workers=min(max_connections, len(chunks)),
+                            thread_name_prefix='smtp') as executor:
+        yield from executor.map(lambda chunk: deliver_chunk(emails, chunk, limits), chunks)
+
+
+def send_mailing(mailing, recipient_ids=None, attempt_number=1, heartbeat=None, recipient_range=None):
+    """Отправляет рассылку всем получателям, только recipient_ids (повтор с номером attempt_number)
+    или только шарду recipient_range.
+
+    Получатели с окончательным итогом в DeliveryState пропускаются, так что повторный запуск после
+    падения досылает только остаток. Возвращает id получателей с временной ошибкой, которых ещё можно
+    повторить; когда попытки (MAILING_RETRY_MAX_ATTEMPTS) кончились, временная ошибка записывается
+    как failed. heartbeat(обработано получателей) вызывается после каждой записанной пачки, после неё
+    же публикуется событие batch с итогами пачки и ходом отправки.
+
+    Начало прохода и завершение рассылки — только при отправке всем; для шардов это делают задачи очереди.
+    """
+    full_pass = recipient_ids is None and recipient_range is None
+    if full_pass:
+        MailingCounters.start_run(mailing.pk, mailing.recipients.count())
+        reset_progress([mailing.pk])
+    suppression = SuppressionList.for_mailing(mailing)
+    recipients, skipped = split_suppressed(pending_recipients(mailing, recipient_ids, recipient_range), suppression)
+    message = mailing.message
+    deliver = import_string(settings.MAILING_DELIVERY_ENGINE)
+    can_retry = attempt_number < settings.MAILING_RETRY_MAX_ATTEMPTS
+    logger.info(f"Начинаем отправку (попытка {attempt_number}) для {len(recipients)} получателей "
+                f"(пропущено {len(skipped)}), пачками по {settings.MAILING_BATCH_SIZE}, "
+                f"соединений до {settings.MAILING_MAX_CONNECTIONS}")
+    publish_progress(mailing.pk, 'run_started', attempt_number=attempt_number, recipients=len(recipients),
+                     skipped=len(skipped))
+
+    deferred = []
+    outcomes = Counter()
+    processed = len(skipped)
+    with AttemptBuffer() as buffer:
+        for recipient, reason in skipped:
+            buffer.add(mailing, recipient, 'suppressed', reason, attempt_number)
+        outcomes['suppressed'] = len(skipped)
+        for results in deliver(message, recipients, limits=mailing_limits(mailing)):
+            bounced = []
+            for recipient, status, response in results:
+                if status == 'bounced':
+                    bounced.append(recipient.email)
+                    status = 'failed'
+                elif status == 'deferred':
+                    if can_retry:
+                        deferred.append(recipient.pk)
+                    else:
+                        status = 'failed'
+                buffer.add(mailing, recipient, status, response, attempt_number)
+                outcomes[status] += 1
+            buffer.flush()
+            suppress_addresses(bounced, 'bounce', f"Рассылка {mailing.pk}")
+            processed += len(results)
+            if heartbeat is not None:
+                heartbeat(processed)
+            publish_progress(mailing.pk, 'batch', attempt_number=attempt_number, **outcomes)
+            outcomes.clear()
+
+    if any(outcomes.values()):
+        # Отправлять было некому, только пропущенные — их записал выход из AttemptBuffer
+        publish_progress(mailing.pk, 'batch', attempt_number=attempt_number, **outcomes)
+    if full_pass:
+        mailing.complete_sending()
+        reset_progress([mailing.pk])
+        publish_progress(mailing.pk, 'status', status=mailing.status)
+    return deferred
+
+
+def publish_progress(mailing_id, event, **data):
+    # Снимок хода отправки строится один раз воркером и кладётся в кэш — зрители его не пересчитывают
+    publish(mailing_id, event, {**data, 'progress': current_progress(mailing_id)})
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def publish(mailing_id, event, data=None):
+    """Публикует событие доставки рассылки для подписчиков SSE.
+
+    В PostgreSQL событие уходит через NOTIFY и доходит до всех процессов веб-сервера; NOTIFY
+    внутри транзакции доставляется только после её фиксации. Для других БД событие раздаётся
+    подписчикам текущего процесса после фиксации транзакции.
+    """
+    payload = json.dumps({'mailing_id': mailing_id, 'event': event, 'data': data or {}}, cls=DjangoJSONEncoder)
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [settings.MAILING_EVENTS_CHANNEL, payload])
+    else:
+        transaction.on_commit(partial(broadcaster.dispatch, payload))
+
+
+def _put(queue, message):
+    # Медленный подписчик теряет самые старые события, а не копит их в памяти
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+class Broadcaster:
+    """Раздаёт события подписчикам процесса: у каждого SSE-соединения своя очередь asyncio.
+
+    dispatch можно вызывать из любого потока: сообщение кладётся в очередь через цикл событий подписчика.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, mailing_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            self.subscribers.setdefault(mailing_id, {})[queue] = loop
+        if connection.vendor == 'postgresql':
+            start_listener()
+        return queue
+
+    def unsubscribe(self, mailing_id, queue):
+        with self.lock:
+            queues = self.subscribers.get(mailing_id, {})
+            queues.pop(queue, None)
+            if not queues:
+                self.subscribers.pop(mailing_id, None)
+
+    def dispatch(self, payload):
+        message = json.loads(payload)
+        with self.lock:
+            targets = list(self.subscribers.get(message['mailing_id'], {}).items())
+        for queue, loop in targets:
+            try:
+                loop.call_soon_threadsafe(_put, queue, message)
+            except RuntimeError:
+                # Цикл событий уже закрыт — соединение отписывается само
+                pass
+        return len(targets)
+
+
+broadcaster = Broadcaster()
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def start_listener():
+    """Запускает в процессе один поток LISTEN: одно соединение с БД на процесс, сколько бы ни было зрителей."""
+    global _listener
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=listen_forever, name='mailing-events', daemon=True)
+            _listener.start()
+
+
+def listen_forever():
+    while True:
+        try:
+            listen()
+        except Exception as e:
+            logger.error(f"Подписка на события рассылок прервана: {str(e)}")
+        time.sleep(settings.MAILING_EVENTS_RECONNECT_DELAY)
+
+
+def listen():
+    db = connections['default']
+    conn = db.get_new_connection(db.get_connection_params())
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {db.ops.quote_name(settings.MAILING_EVENTS_CHANNEL)}")
+        logger.info(f"Подписка на события рассылок: канал {settings.MAILING_EVENTS_CHANNEL}")
+        while True:
+            if select.select([conn], [], [], settings.MAILING_EVENTS_KEEPALIVE) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                broadcaster.dispatch(conn.notifies.pop(0).payload)
+    finally:
+        conn.close()
+
+
+def release_connections():
+    """Закрывает соединения с БД текущего потока: поток SSE не должен держать соединение до конца ответа."""
+    for conn in connections.all(initialized_only=True):
+        # Внутри транзакции (тесты) соединение не трогаем
+        if not conn.in_atomic_block:
+            conn.close()
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def event_stream(mailing_id, initial=None):
+    """Поток SSE для рассылки: сначала текущий ход отправки, дальше события по мере публикации."""
+    queue = broadcaster.subscribe(mailing_id)
+    try:
+        if initial is not None:
+            yield format_event('progress', initial)
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), settings.MAILING_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Комментарий SSE держит соединение открытым через прокси
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(message['event'], message['data'])
+    finally:
+        broadcaster.unsubscribe(mailing_id, queue)
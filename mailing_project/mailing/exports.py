@@ -0,0 +1,71 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import DeliveryAttempt
+
+EXPORT_FIELDS = ('id', 'mailing_id', 'owner_email', 'recipient_email', 'status', 'attempt_number', 'attempt_time',
+                 'server_response')
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+
+def parse_time(value):
+    """ISO 8601 → aware datetime; дата без зоны считается в текущей зоне. Ошибка — ValueError."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Некорректная дата: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def attempts_for_export(mailing_id=None, owner_id=None, status=None, since=None, until=None):
+    """Попытки доставки для выгрузки: только нужные колонки кортежами, в порядке первичного ключа."""
+    queryset = DeliveryAttempt.objects.all()
+    if mailing_id is not None:
+        queryset = queryset.filter(mailing_id=mailing_id)
+    if owner_id is not None:
+        queryset = queryset.filter(mailing__owner_id=owner_id)
+    if status:
+        queryset = queryset.filter(status=status)
+    if since is not None:
+        queryset = queryset.filter(attempt_time__gte=since)
+    if until is not None:
+        queryset = queryset.filter(attempt_time__lt=until)
+    return queryset.order_by('id').values_list(
+        'id', 'mailing_id', 'mailing__owner__email', 'recipient__email', 'status', 'attempt_number',
+        'attempt_time', 'server_response',
+    )
+
+
+def iter_rows(queryset, chunk_size=None):
+    # На PostgreSQL iterator() читает через серверный курсор: в памяти только одна пачка строк
+    return queryset.iterator(chunk_size=chunk_size or settings.MAILING_EXPORT_CHUNK_SIZE)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def export_lines(queryset, export_format, chunk_size=None):
+    rows = iter_rows(queryset, chunk_size)
+    if export_format == 'ndjson':
+        return ndjson_lines(rows)
+    return csv_lines(rows)
@@ -23,4 +23,8 @@ class RecipientForm(forms.ModelForm):
 class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
-        fields = ['subject', 'body']
+        fields = ['subject', 'body', 'html_body']
+
+
+class RecipientImportForm(forms.Form):
+    file = forms.FileField(label="CSV-файл", help_text="Колонки: email, full_name, comment")
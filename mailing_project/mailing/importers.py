@@ -0,0 +1,192 @@
+import csv
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .models import Recipient, SuppressedAddress
+
+logger = logging.getLogger(__name__)
+
+ERROR_FIELDS = ['line', 'email', 'full_name', 'comment', 'error']
+
+
+class ImportResult:
+    def __init__(self, errors_preview_size=100):
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors_preview = []
+        self.errors_preview_size = errors_preview_size
+
+    def add_error(self, error):
+        self.failed += 1
+        if len(self.errors_preview) < self.errors_preview_size:
+            self.errors_preview.append(error)
+
+
+def clean_recipient_row(row):
+    email = (row.get('email') or '').strip().lower()
+    full_name = (row.get('full_name') or '').strip()
+    comment = (row.get('comment') or '').strip()
+    validate_email(email)
+    if not full_name:
+        raise ValidationError("Не указано имя")
+    if len(full_name) > 100 or len(comment) > 100:
+        raise ValidationError("Имя и описание — не длиннее 100 символов")
+    return email, full_name, comment
+
+
+def upsert_recipients(recipients, batch_size):
+    """Сохраняет пачку получателей одного владельца ({email: Recipient}).
+
+    Адрес уже есть у этого владельца — обновляем имя и описание. Адреса чужих получателей не трогаем
+    и возвращаем как {email: ошибка}.
+    """
+    with transaction.atomic():
+        # Блокируем найденные строки: владелец и имя не поменяются до конца пачки. Ключи пачки в нижнем
+        # регистре, а в базе адрес мог сохраниться как введён в форме — сравниваем без учёта регистра
+        owners = {}
+        for email, stored, owner_id in (Recipient.objects.select_for_update()
+                                        .annotate(email_lower=Lower('email'))
+                                        .filter(email_lower__in=recipients)
+                                        .order_by('pk')
+                                        .values_list('email_lower', 'email', 'owner_id')):
+            owners.setdefault(email, (stored, owner_id))
+        rejected = {email: "Адрес уже есть у получателя другого пользователя"
+                    for email, recipient in recipients.items()
+                    if email in owners and owners[email][1] != recipient.owner_id}
+        for email, recipient in recipients.items():
+            if email in owners:
+                # Обновление находит строку по адресу в том виде, в каком он сохранён
+                recipient.email = owners[email][0]
+        Recipient.objects.bulk_create(
+            [recipient for email, recipient in recipients.items() if email in owners and email not in rejected],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['email'],
+            update_fields=['full_name', 'comment'],
+        )
+        # Новый адрес мог параллельно добавить другой пользователь — его строку не перезаписываем
+        Recipient.objects.bulk_create(
+            [recipient for email, recipient in recipients.items() if email not in owners],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+    return rejected
+
+
+def rows(reader):
+    # Строки CSV с номерами; испорченный файл — ValidationError (ошибка формы), а не 500
+    try:
+        yield from enumerate(reader, start=2)
+    except csv.Error as e:
+        raise ValidationError(f"Строка {reader.line_num}: файл не разбирается как CSV ({str(e)})")
+
+
+def stream_import(lines, clean_row, save_batch, batch_size, error_writer=None, progress=None):
+    """Построчно читает CSV с колонкой email и пачками передаёт очищенные строки в save_batch.
+
+    Файл не загружается в память целиком: в памяти только текущая пачка. clean_row возвращает
+    (ключ, объект) или бросает ValidationError; save_batch получает {ключ: объект} и может вернуть
+    {ключ: ошибка} для несохранённых строк. Строки с ошибками пишутся в error_writer
+    (csv.DictWriter с ERROR_FIELDS), progress вызывается после каждой пачки.
+    """
+    result = ImportResult()
+    reader = csv.DictReader(lines)
+    try:
+        fieldnames = reader.fieldnames
+    except csv.Error as e:
+        raise ValidationError(f"Файл не разбирается как CSV: {str(e)}")
+    if not fieldnames or 'email' not in fieldnames:
+        raise ValidationError("В CSV нет колонки email")
+
+    def add_error(line, row, message):
+        error = {field: row.get(field) for field in ERROR_FIELDS if field in row}
+        error.update({'line': line, 'error': message})
+        result.add_error(error)
+        if error_writer is not None:
+            error_writer.writerow(error)
+
+    def save(batch):
+        rejected = save_batch({key: obj for key, (line, row, obj) in batch.items()}, batch_size) or {}
+        for key, message in rejected.items():
+            line, row, obj = batch[key]
+            add_error(line, row, message)
+        result.imported += len(batch) - len(rejected)
+
+    # Словарь по ключу: одинаковый адрес дважды в одной пачке INSERT ... ON CONFLICT не примет
+    batch = {}
+    for line, row in rows(reader):
+        result.rows += 1
+        try:
+            if any(isinstance(value, str) and '\x00' in value for value in row.values()):
+                # csv пропускает NUL, а PostgreSQL не примет его в текстовом поле
+                raise ValidationError("Недопустимый символ NUL")
+            key, obj = clean_row(row)
+        except ValidationError as e:
+            add_error(line, row, '; '.join(e.messages))
+            continue
+        batch[key] = (line, row, obj)
+        if len(batch) >= batch_size:
+            save(batch)
+            batch = {}
+            if progress is not None:
+                progress(result)
+
+    if batch:
+        save(batch)
+    if progress is not None:
+        progress(result)
+    return result
+
+
+def import_recipients(lines, owner, batch_size=None, error_writer=None, progress=None):
+    """Потоковый импорт получателей из CSV (email, full_name, comment) с обновлением существующих."""
+    def clean_row(row):
+        email, full_name, comment = clean_recipient_row(row)
+        return email, Recipient(email=email, full_name=full_name, comment=comment, owner=owner)
+
+    result = stream_import(lines, clean_row, upsert_recipients, batch_size or settings.MAILING_IMPORT_BATCH_SIZE,
+                           error_writer, progress)
+    logger.info(f"Импорт получателей: строк {result.rows}, сохранено {result.imported}, ошибок {result.failed}")
+    return result
+
+
+def clean_suppression_row(row, default_reason):
+    email = (row.get('email') or '').strip().lower()
+    reason = (row.get('reason') or '').strip() or default_reason
+    comment = (row.get('comment') or '').strip()
+    validate_email(email)
+    if reason not in dict(SuppressedAddress.REASON_CHOICES):
+        raise ValidationError(f"Неизвестная причина: {reason}")
+    if len(comment) > 255:
+        raise ValidationError("Описание — не длиннее 255 символов")
+    return email, reason, comment
+
+
+def upsert_suppressions(addresses, batch_size):
+    # Список подавления общий, без владельцев: адрес просто обновляется
+    SuppressedAddress.objects.bulk_create(
+        list(addresses.values()),
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['email'],
+        update_fields=['reason', 'comment'],
+    )
+
+
+def import_suppressions(lines, reason='manual', batch_size=None, error_writer=None, progress=None):
+    """Потоковый импорт списка подавления из CSV (email, необязательные reason и comment)."""
+    def clean_row(row):
+        email, row_reason, comment = clean_suppression_row(row, reason)
+        return email, SuppressedAddress(email=email, reason=row_reason, comment=comment)
+
+    result = stream_import(lines, clean_row, upsert_suppressions, batch_size or settings.MAILING_IMPORT_BATCH_SIZE,
+                           error_writer, progress)
+    logger.info(f"Импорт списка подавления: строк {result.rows}, сохранено {result.imported}, "
+                f"ошибок {result.failed}")
+    return result
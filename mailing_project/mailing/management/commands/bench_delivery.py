@@ -0,0 +1,92 @@
+import math
+import multiprocessing
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from mailing.async_delivery import deliver_async
+from mailing.delivery import deliver_parallel
+
+ENGINES = {'threads': deliver_parallel, 'asyncio': deliver_async}
+
+
+class AcceptAllHandler:
+    async def handle_DATA(self, server, session, envelope):
+        return '250 OK'
+
+
+def serve(port, ready, stop):
+    # SMTP-сервер в отдельном процессе: его работа не попадает в CPU клиента и не делит с ним GIL
+    from aiosmtpd.controller import Controller
+
+    controller = Controller(AcceptAllHandler(), hostname='127.0.0.1', port=port)
+    controller.start()
+    ready.set()
+    stop.wait()
+    controller.stop()
+
+
+class Command(BaseCommand):
+    help = ("Бенчмарк отправки на локальный SMTP-сервер (нужен aiosmtpd): писем в секунду и CPU клиента на письмо "
+            "для пула потоков и движка asyncio (нужен aiosmtplib)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help="Писем на один прогон")
+        parser.add_argument('--connections', type=int, nargs='+', default=[1, 4, 16, 64])
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--engine', choices=ENGINES, nargs='+', default=['threads', 'asyncio'])
+        parser.add_argument('--static', action='store_true',
+                            help="Письмо без подстановок: общий MIME на весь проход")
+
+    def handle(self, *args, **kwargs):
+        try:
+            import aiosmtpd  # noqa: F401
+        except ImportError:
+            raise CommandError("Для бенчмарка нужен aiosmtpd: pip install aiosmtpd")
+
+        total = kwargs['messages']
+        levels = kwargs['connections']
+        greeting = "Hello!" if kwargs['static'] else "Hello {{ full_name }}!"
+        message = SimpleNamespace(subject="Benchmark", body=f"{greeting} " + "Hello " * 50)
+        recipients = [SimpleNamespace(email=f"user{i}@example.com", full_name=f"User {i}") for i in range(total)]
+
+        ready, stop = multiprocessing.Event(), multiprocessing.Event()
+        server = multiprocessing.Process(target=serve, args=(kwargs['port'], ready, stop), daemon=True)
+        server.start()
+        if not ready.wait(10):
+            server.terminate()
+            raise CommandError("Локальный SMTP-сервер не запустился")
+        try:
+            with override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                EMAIL_HOST='127.0.0.1', EMAIL_PORT=kwargs['port'],
+                EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                EMAIL_USE_SSL=False, EMAIL_USE_TLS=False,
+                DEFAULT_FROM_EMAIL='bench@example.com',
+                MAILING_GLOBAL_MAX_CONNECTIONS=max(levels),
+            ):
+                for engine in kwargs['engine']:
+                    for connections in levels:
+                        self.run_level(engine, message, recipients, connections)
+        finally:
+            stop.set()
+            server.join()
+
+    def run_level(self, engine, message, recipients, connections):
+        batch_size = math.ceil(len(recipients) / connections)
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        sent = failed = 0
+        for results in ENGINES[engine](message, recipients, max_connections=connections, batch_size=batch_size):
+            for recipient, status, response in results:
+                if status == 'success':
+                    sent += 1
+                else:
+                    failed += 1
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        self.stdout.write(f"{engine:>7}, {connections:>3} соединений: {sent / elapsed:8.0f} писем/с, "
+                          f"CPU клиента {cpu / max(sent, 1) * 1e6:.0f} мкс на письмо "
+                          f"(отправлено {sent}, ошибок {failed}, {elapsed:.2f} с)")
@@ -0,0 +1,68 @@
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+
+from mailing.delivery import EmailFactory, compose_email
+from mailing.personalization import CompiledMessage, recipient_values
+
+SUBJECT = "{{ full_name }}, новости недели"
+BODY = "Здравствуйте, {{ full_name }}!\n\n" + "Текст рассылки. " * 100 + "\n\nПисьмо отправлено на {{ email }}."
+HTML_BODY = "<html><body>" + "<p>Текст <b>рассылки</b> с разметкой.</p>\n" * 1000 + "</body></html>"
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк подстановки {{ full_name }}/{{ email }}: стоимость на получателя, мкс"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=100_000)
+        parser.add_argument('--django-sample', type=int, default=10_000,
+                            help="Сколько получателей прогнать через django.template для сравнения (0 — не сравнивать)")
+        parser.add_argument('--mime-sample', type=int, default=2_000,
+                            help="Сколько писем с HTML собрать в байты: заново и из общего MIME (0 — не мерить)")
+
+    def handle(self, *args, **kwargs):
+        total = kwargs['recipients']
+        recipients = [SimpleNamespace(email=f"user{i}@example.com", full_name=f"User {i}") for i in range(total)]
+
+        started = time.perf_counter()
+        compiled = CompiledMessage(SUBJECT, BODY)
+        compile_time = time.perf_counter() - started
+        self.stdout.write(f"Компиляция шаблона: {compile_time * 1e6:.1f} мкс (один раз на проход)")
+
+        started = time.perf_counter()
+        for recipient in recipients:
+            compiled.render(recipient)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Подстановка: {total} получателей за {elapsed:.3f} с, "
+                          f"{elapsed / total * 1e6:.2f} мкс на получателя")
+
+        sample = min(kwargs['django_sample'], total)
+        if sample:
+            subject, body = Template(SUBJECT), Template(BODY)
+            started = time.perf_counter()
+            for recipient in recipients[:sample]:
+                context = Context(recipient_values(recipient), autoescape=False)
+                subject.render(context), body.render(context)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"django.template для сравнения: {elapsed / sample * 1e6:.2f} мкс на получателя "
+                              f"(выборка {sample})")
+
+        sample = min(kwargs['mime_sample'], total)
+        if sample:
+            self.bench_mime(recipients[:sample])
+
+    def bench_mime(self, recipients):
+        static = CompiledMessage("Новости недели", "Текст рассылки. " * 100, HTML_BODY)
+        factory = EmailFactory(static)
+        for label, build in [
+            ("MIME на каждого получателя", lambda recipient: compose_email(*static.render(recipient), [recipient.email])),
+            ("общий MIME, свои To, Date и Message-ID", factory.build),
+        ]:
+            started = time.perf_counter()
+            for recipient in recipients:
+                build(recipient).message().as_bytes(linesep='\r\n')
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{label}: {elapsed / len(recipients) * 1e6:.1f} мкс на письмо "
+                              f"(HTML {len(HTML_BODY.encode()) // 1024} КБ, выборка {len(recipients)})")
@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mailing.exports import EXPORT_FORMATS, attempts_for_export, export_lines, parse_time
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка истории попыток доставки в CSV или NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mailing', type=int, default=None, help="ID рассылки")
+        parser.add_argument('--owner', type=int, default=None, help="ID владельца рассылок")
+        parser.add_argument('--status', choices=['success', 'failed', 'deferred', 'suppressed'], default=None)
+        parser.add_argument('--since', default=None, help="Начало периода (ISO 8601), включительно")
+        parser.add_argument('--until', default=None, help="Конец периода (ISO 8601), не включительно")
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--output', default='-', help="Файл для выгрузки или - для stdout")
+
+    def handle(self, *args, **kwargs):
+        since = self.parse_time(kwargs['since'])
+        until = self.parse_time(kwargs['until'])
+        queryset = attempts_for_export(mailing_id=kwargs['mailing'], owner_id=kwargs['owner'],
+                                       status=kwargs['status'], since=since, until=until)
+
+        output = sys.stdout if kwargs['output'] == '-' else open(kwargs['output'], 'w', newline='', encoding='utf-8')
+        try:
+            for line in export_lines(queryset, kwargs['format'], kwargs['chunk_size']):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    def parse_time(self, value):
+        if value is None:
+            return None
+        try:
+            return parse_time(value)
+        except ValueError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,47 @@
+import csv
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from mailing.importers import ERROR_FIELDS, import_recipients
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Потоковый импорт получателей из CSV (колонки email, full_name, comment)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Путь к CSV-файлу или - для stdin")
+        parser.add_argument('--owner', required=True, help="Email владельца получателей")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--errors', default=None, help="Куда записать строки с ошибками (CSV)")
+
+    def handle(self, *args, **kwargs):
+        try:
+            owner = CustomUser.objects.get(email=kwargs['owner'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"Пользователь {kwargs['owner']} не найден")
+
+        source = sys.stdin if kwargs['path'] == '-' else open(kwargs['path'], newline='', encoding='utf-8-sig')
+        errors_file = open(kwargs['errors'], 'w', newline='', encoding='utf-8') if kwargs['errors'] else None
+        try:
+            error_writer = None
+            if errors_file is not None:
+                error_writer = csv.DictWriter(errors_file, fieldnames=ERROR_FIELDS)
+                error_writer.writeheader()
+            result = import_recipients(source, owner, batch_size=kwargs['batch_size'],
+                                       error_writer=error_writer, progress=self.report)
+        except ValidationError as e:
+            raise CommandError('; '.join(e.messages))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if errors_file is not None:
+                errors_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: строк {result.rows}, сохранено {result.imported}, ошибок {result.failed}"))
+
+    def report(self, result):
+        self.stdout.write(f"Обработано строк: {result.rows}, сохранено: {result.imported}, ошибок: {result.failed}")
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mailing.partitions import ensure_attempt_partitions, prune_attempt_partitions
+
+
+class Command(BaseCommand):
+    help = "Удаляет или архивирует месячные секции истории доставки старше срока хранения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=settings.MAILING_ATTEMPT_RETENTION_MONTHS,
+                            help="Сколько последних месяцев хранить")
+        parser.add_argument('--archive', action='store_true',
+                            help="Отсоединить секции (DETACH) вместо удаления: данные остаются отдельными таблицами")
+
+    def handle(self, *args, **kwargs):
+        created = ensure_attempt_partitions()
+        pruned = prune_attempt_partitions(keep_months=kwargs['keep_months'], archive=kwargs['archive'])
+        action = "отсоединено" if kwargs['archive'] else "удалено"
+        self.stdout.write(f"Секций создано/проверено: {len(created)}")
+        self.stdout.write(self.style.SUCCESS(f"Секций {action}: {len(pruned)}"))
+        for name in pruned:
+            self.stdout.write(f"  {name}")
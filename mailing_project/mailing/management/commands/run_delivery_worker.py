@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from mailing.partitions import ensure_attempt_partitions
+from mailing.tasks import process_next_job, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди отправки рассылок"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Обработать очередь и выйти")
+        parser.add_argument('--interval', type=float, default=settings.MAILING_WORKER_POLL_INTERVAL,
+                            help="Пауза между опросами пустой очереди, сек.")
+        parser.add_argument('--processes', type=int, default=1,
+                            help="Сколько процессов-воркеров запустить: шарды рассылки они забирают независимо")
+
+    def handle(self, *args, **kwargs):
+        # Секции истории доставки — до первой записанной попытки, даже если планировщик не запущен
+        ensure_attempt_partitions()
+        if kwargs['processes'] > 1:
+            self.run_processes(kwargs)
+        else:
+            self.run_worker(kwargs)
+
+    def run_processes(self, options):
+        # Дочерние процессы открывают свои соединения с БД — унаследованное закрываем до fork
+        connections.close_all()
+        # Именно fork: при spawn (по умолчанию на macOS) потомок импортировал бы команду без django.setup()
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=self.run_worker, args=(options,))
+                   for _ in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+
+        def forward(signum, frame):
+            for worker in workers:
+                if worker.is_alive():
+                    os.kill(worker.pid, signum)
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        for worker in workers:
+            worker.join()
+
+    def run_worker(self, options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.stdout.write(f"Воркер {worker} запущен")
+
+        while not self.stopping:
+            job = process_next_job(worker)
+            if job is not None:
+                self.stdout.write(f"Задача {job.id} (рассылка {job.mailing_id}): {job.status}")
+                continue
+            if options['once']:
+                break
+            # Очередь пуста — подбираем задачи упавших воркеров
+            if requeue_stale_jobs():
+                continue
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Воркер {worker} остановлен"))
+
+    def stop(self, signum, frame):
+        # Текущая задача доводится до конца, новые не забираются
+        self.stopping = True
@@ -0,0 +1,41 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mailing.scheduler import run_scheduler_once, seconds_until_next_start
+
+
+class Command(BaseCommand):
+    help = "Планировщик: запускает рассылки по start_datetime и завершает по end_datetime"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Один проход и выход")
+        parser.add_argument('--interval', type=float, default=settings.MAILING_SCHEDULER_INTERVAL,
+                            help="Максимальная пауза между проходами, сек.")
+
+    def handle(self, *args, **kwargs):
+        self.stopping = threading.Event()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.stdout.write("Планировщик запущен")
+
+        while not self.stopping.is_set():
+            launched, changed = run_scheduler_once()
+            completed = changed['started_to_completed'] + changed['created_to_completed']
+            if launched or completed:
+                self.stdout.write(f"Запущено: {len(launched)}, завершено: {completed}")
+            if kwargs['once']:
+                break
+            if launched:
+                # Возможно, наступивших рассылок больше лимита одного прохода
+                continue
+            # Спим до ближайшего старта, но не дольше interval: завершения и новые рассылки
+            # подхватываются на следующем проходе
+            self.stopping.wait(max(0, seconds_until_next_start(default=kwargs['interval'])))
+
+        self.stdout.write(self.style.SUCCESS("Планировщик остановлен"))
+
+    def stop(self, signum, frame):
+        self.stopping.set()
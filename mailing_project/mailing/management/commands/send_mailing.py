@@ -12,5 +12,6 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         mailing_id = kwargs['mailing_id']
         mailing = Mailing.objects.get(id=mailing_id)
-        send_mailing_task(mailing.id)
-        self.stdout.write(self.style.SUCCESS(f"Рассылка {mailing.subject} запущена!"))
+        jobs = send_mailing_task(mailing.id)
+        self.stdout.write(self.style.SUCCESS(f"Рассылка {mailing.subject} поставлена в очередь "
+                                             f"(шардов: {len(jobs)}, задачи {', '.join(str(job.id) for job in jobs)})"))
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_counters(apps, schema_editor):
+    DeliveryAttempt = apps.get_model('mailing', 'DeliveryAttempt')
+    MailingCounters = apps.get_model('mailing', 'MailingCounters')
+    totals = (DeliveryAttempt.objects
+              .values('mailing_id')
+              .annotate(total=Count('id'),
+                        successful=Count('id', filter=Q(status='success')),
+                        failed=Count('id', filter=Q(status='failed'))))
+    MailingCounters.objects.bulk_create([
+        MailingCounters(mailing_id=row['mailing_id'], total_attempts=row['total'],
+                        successful_attempts=row['successful'], failed_attempts=row['failed'])
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0003_deliveryjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailingCounters',
+            fields=[
+                ('mailing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='mailing.mailing')),
+                ('total_attempts', models.PositiveIntegerField(default=0)),
+                ('successful_attempts', models.PositiveIntegerField(default=0)),
+                ('failed_attempts', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Счётчики рассылки',
+                'verbose_name_plural': 'Счётчики рассылок',
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0004_mailingcounters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['status', 'start_datetime'], name='mailing_status_start'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_attempt_time_brin(apps, schema_editor):
+    # BRIN по времени попытки: строки пишутся почти по порядку времени, индекс занимает килобайты
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS attempt_time_brin ON mailing_deliveryattempt USING brin (attempt_time)'
+        )
+
+
+def drop_attempt_time_brin(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS attempt_time_brin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0005_mailing_status_start_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='deliveryjob',
+            name='mailing_job_status_created',
+        ),
+        migrations.AddIndex(
+            model_name='deliveryattempt',
+            index=models.Index(fields=['mailing', 'status'], name='attempt_mailing_status'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(condition=models.Q(('status', 'queued')), fields=['created_at'], name='job_queued_created'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['mailing', 'status'], name='job_mailing_status'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['owner', 'id'], name='mailing_owner_id'),
+        ),
+        migrations.AddIndex(
+            model_name='mailingcounters',
+            index=models.Index(fields=['-updated_at'], name='counters_updated_at'),
+        ),
+        migrations.AddIndex(
+            model_name='mailingstatistics',
+            index=models.Index(fields=['-sent_at'], name='mailingstat_sent_at'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['owner', 'id'], name='message_owner_id'),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(fields=['owner', 'id'], name='recipient_owner_id'),
+        ),
+        migrations.RunPython(create_attempt_time_brin, drop_attempt_time_brin),
+    ]
@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+COLUMNS = 'id, attempt_time, status, server_response, mailing_id, recipient_id'
+
+
+def _month(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def _next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_attempts(apps, schema_editor):
+    """Переносит mailing_deliveryattempt в таблицу, секционированную по месяцам attempt_time.
+
+    Первичный ключ секционированной таблицы обязан включать ключ секционирования, поэтому он
+    становится (id, attempt_time); id по-прежнему выдаётся одной последовательностью.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    execute = schema_editor.execute
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min(attempt_time), coalesce(max(id), 0) FROM mailing_deliveryattempt')
+        oldest, max_id = cursor.fetchone()
+
+    execute('ALTER TABLE mailing_deliveryattempt RENAME TO mailing_deliveryattempt_old')
+    execute('CREATE SEQUENCE mailing_deliveryattempt_part_id_seq')
+    execute("SELECT setval('mailing_deliveryattempt_part_id_seq', %s, false)", [max_id + 1])
+    execute(
+        "CREATE TABLE mailing_deliveryattempt ("
+        " id bigint NOT NULL DEFAULT nextval('mailing_deliveryattempt_part_id_seq'),"
+        " attempt_time timestamp with time zone NOT NULL,"
+        " status varchar(10) NOT NULL,"
+        " server_response text NULL,"
+        " mailing_id bigint NOT NULL REFERENCES mailing_mailing (id) DEFERRABLE INITIALLY DEFERRED,"
+        " recipient_id bigint NOT NULL REFERENCES mailing_recipient (id) DEFERRABLE INITIALLY DEFERRED,"
+        " CONSTRAINT mailing_deliveryattempt_part_pkey PRIMARY KEY (id, attempt_time)"
+        ") PARTITION BY RANGE (attempt_time)"
+    )
+    execute('ALTER SEQUENCE mailing_deliveryattempt_part_id_seq OWNED BY mailing_deliveryattempt.id')
+    execute('CREATE TABLE mailing_deliveryattempt_default PARTITION OF mailing_deliveryattempt DEFAULT')
+
+    # Секции на всю историю и на текущий месяц; следующие создаёт ensure_attempt_partitions
+    month = _month(oldest) if oldest is not None else _month(datetime.now(timezone.utc))
+    last = _month(datetime.now(timezone.utc))
+    while month <= last:
+        execute(
+            f'CREATE TABLE mailing_deliveryattempt_p{month:%Y%m} PARTITION OF mailing_deliveryattempt '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            [month, _next_month(month)],
+        )
+        month = _next_month(month)
+
+    execute(f'INSERT INTO mailing_deliveryattempt ({COLUMNS}) SELECT {COLUMNS} FROM mailing_deliveryattempt_old')
+    execute('DROP TABLE mailing_deliveryattempt_old')
+    execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    execute('CREATE INDEX mailing_deliveryattempt_mailing_id_453c9d0a ON mailing_deliveryattempt (mailing_id)')
+    execute('CREATE INDEX mailing_deliveryattempt_recipient_id_4b1484ea ON mailing_deliveryattempt (recipient_id)')
+    execute('CREATE INDEX attempt_mailing_status ON mailing_deliveryattempt (mailing_id, status)')
+    execute('CREATE INDEX attempt_time_brin ON mailing_deliveryattempt USING brin (attempt_time)')
+
+
+def unpartition_attempts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    execute = schema_editor.execute
+    execute('ALTER TABLE mailing_deliveryattempt RENAME TO mailing_deliveryattempt_part')
+    execute('ALTER INDEX mailing_deliveryattempt_mailing_id_453c9d0a RENAME TO mailing_deliveryattempt_part_mailing')
+    execute('ALTER INDEX mailing_deliveryattempt_recipient_id_4b1484ea '
+            'RENAME TO mailing_deliveryattempt_part_recipient')
+    execute('ALTER INDEX attempt_mailing_status RENAME TO mailing_deliveryattempt_part_mailing_status')
+    execute('ALTER INDEX attempt_time_brin RENAME TO mailing_deliveryattempt_part_time_brin')
+    execute(
+        "CREATE TABLE mailing_deliveryattempt ("
+        " id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,"
+        " attempt_time timestamp with time zone NOT NULL,"
+        " status varchar(10) NOT NULL,"
+        " server_response text NULL,"
+        " mailing_id bigint NOT NULL REFERENCES mailing_mailing (id) DEFERRABLE INITIALLY DEFERRED,"
+        " recipient_id bigint NOT NULL REFERENCES mailing_recipient (id) DEFERRABLE INITIALLY DEFERRED"
+        ")"
+    )
+    execute(f'INSERT INTO mailing_deliveryattempt ({COLUMNS}) SELECT {COLUMNS} FROM mailing_deliveryattempt_part')
+    execute("SELECT setval(pg_get_serial_sequence('mailing_deliveryattempt', 'id'), "
+            "coalesce((SELECT max(id) FROM mailing_deliveryattempt), 0) + 1, false)")
+    execute('DROP TABLE mailing_deliveryattempt_part CASCADE')
+    # Отложенные проверки внешних ключей после INSERT не дают строить индексы в этой же транзакции
+    execute('SET CONSTRAINTS ALL IMMEDIATE')
+    execute('CREATE INDEX mailing_deliveryattempt_mailing_id_453c9d0a ON mailing_deliveryattempt (mailing_id)')
+    execute('CREATE INDEX mailing_deliveryattempt_recipient_id_4b1484ea ON mailing_deliveryattempt (recipient_id)')
+    execute('CREATE INDEX attempt_mailing_status ON mailing_deliveryattempt (mailing_id, status)')
+    execute('CREATE INDEX attempt_time_brin ON mailing_deliveryattempt USING brin (attempt_time)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_attempts, unpartition_attempts),
+    ]
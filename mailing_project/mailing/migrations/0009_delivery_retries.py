@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0008_ratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryattempt',
+            name='attempt_number',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='attempt_number',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='kind',
+            field=models.CharField(choices=[('send', 'Отправка'), ('retry', 'Повтор')], default='send', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='recipient_ids',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='run_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='deliveryattempt',
+            name='status',
+            field=models.CharField(choices=[('success', 'Успешно'), ('failed', 'Не успешно'), ('deferred', 'Отложено')], max_length=10),
+        ),
+    ]
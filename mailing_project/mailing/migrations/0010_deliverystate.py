@@ -0,0 +1,60 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def backfill_states(apps, schema_editor):
+    # Итог по уже сделанным попыткам, чтобы повторный запуск старой рассылки не слал письма заново
+    DeliveryAttempt = apps.get_model('mailing', 'DeliveryAttempt')
+    DeliveryState = apps.get_model('mailing', 'DeliveryState')
+    rows = (DeliveryAttempt.objects
+            .values('mailing_id', 'recipient_id')
+            .annotate(successful=Count('id', filter=Q(status='success')),
+                      failed=Count('id', filter=Q(status='failed')),
+                      attempt_number=Max('attempt_number'),
+                      updated_at=Max('attempt_time'))
+            .order_by())
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        status = 'success' if row['successful'] else 'failed' if row['failed'] else 'deferred'
+        batch.append(DeliveryState(mailing_id=row['mailing_id'], recipient_id=row['recipient_id'], status=status,
+                                   attempt_number=row['attempt_number'], updated_at=row['updated_at']))
+        if len(batch) >= 2000:
+            DeliveryState.objects.bulk_create(batch)
+            batch = []
+    DeliveryState.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0009_delivery_retries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DeliveryState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('success', 'Успешно'), ('failed', 'Не успешно'), ('deferred', 'Отложено')], max_length=10)),
+                ('attempt_number', models.PositiveSmallIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_states', to='mailing.mailing')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mailing.recipient')),
+            ],
+            options={
+                'verbose_name': 'Состояние доставки',
+                'verbose_name_plural': 'Состояния доставки',
+                'constraints': [models.UniqueConstraint(fields=('mailing', 'recipient'), name='delivery_state_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_states, migrations.RunPython.noop),
+    ]
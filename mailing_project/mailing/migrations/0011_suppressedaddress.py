@@ -0,0 +1,37 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0010_deliverystate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuppressedAddress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('reason', models.CharField(choices=[('bounce', 'Адрес не существует'), ('unsubscribe', 'Отписка'), ('complaint', 'Жалоба на спам'), ('manual', 'Добавлен вручную')], default='manual', max_length=20)),
+                ('comment', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Заблокированный адрес',
+                'verbose_name_plural': 'Список подавления',
+            },
+        ),
+        migrations.AlterField(
+            model_name='deliveryattempt',
+            name='status',
+            field=models.CharField(choices=[('success', 'Успешно'), ('failed', 'Не успешно'), ('deferred', 'Отложено'), ('suppressed', 'Не отправлено: адрес в списке подавления')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='deliverystate',
+            name='status',
+            field=models.CharField(choices=[('success', 'Успешно'), ('failed', 'Не успешно'), ('deferred', 'Отложено'), ('suppressed', 'Не отправлено: адрес в списке подавления')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,30 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+import mailing.personalization
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0011_suppressedaddress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Дата изменения'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='subject',
+            field=models.CharField(help_text='Можно использовать {{ full_name }} и {{ email }} получателя', max_length=255, validators=[mailing.personalization.validate_placeholders], verbose_name='Тема'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='body',
+            field=models.TextField(validators=[mailing.personalization.validate_placeholders], verbose_name='Тело сообщения'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:58
+
+import mailing.personalization
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0012_message_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='html_body',
+            field=models.TextField(blank=True, help_text='Необязательно: письмо уйдёт как multipart с текстом и HTML', validators=[mailing.personalization.validate_placeholders], verbose_name='HTML-версия'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0013_message_html_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingcounters',
+            name='recipients_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mailingcounters',
+            name='run_base',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mailingcounters',
+            name='run_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailingcounters',
+            name='suppressed_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0014_counters_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='processed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='range_end',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='range_start',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='recipients_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
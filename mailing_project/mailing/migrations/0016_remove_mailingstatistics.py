@@ -0,0 +1,16 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:35
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0015_deliveryjob_shards'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='MailingStatistics',
+        ),
+    ]
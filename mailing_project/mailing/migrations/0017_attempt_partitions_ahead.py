@@ -0,0 +1,20 @@
+from django.db import migrations
+
+from mailing.partitions import ensure_attempt_partitions
+
+
+def create_partitions_ahead(apps, schema_editor):
+    # 0007 создала секции только до текущего месяца: следующие создаём сразу, а не на первом проходе
+    # планировщика — иначе попытки нового месяца успели бы попасть в DEFAULT
+    ensure_attempt_partitions()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0016_remove_mailingstatistics'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_partitions_ahead, migrations.RunPython.noop),
+    ]
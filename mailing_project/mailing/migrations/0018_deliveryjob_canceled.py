@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0017_attempt_partitions_ahead'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнена'), ('failed', 'Ошибка'), ('canceled', 'Отменена')], default='queued', max_length=10),
+        ),
+    ]
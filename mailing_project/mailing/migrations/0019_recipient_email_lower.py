@@ -0,0 +1,20 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:52
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0018_deliveryjob_canceled'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='recipient_email_lower'),
+        ),
+    ]
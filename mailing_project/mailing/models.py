@@ -1,29 +1,9 @@
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.db import models
+from django.db.models.functions import Lower
 from django.conf import settings
-import logging
 
-logger = logging.getLogger(__name__)
-
-
-class MailingStatistics(models.Model):
-    mailing = models.ForeignKey("Mailing", on_delete=models.CASCADE, related_name="statistics")
-    sent_at = models.DateTimeField(default=timezone.now)
-    status = models.CharField(max_length=20, choices=[
-        ("success", "Успешно"),
-        ("failed", "Ошибка"),
-        ("pending", "В ожидании"),
-    ], default="pending")
-    recipient = models.EmailField()
-    response_message = models.TextField(blank=True, null=True)
-
-    class Meta:
-        verbose_name = "Статистика рассылки"
-        verbose_name_plural = "Статистика рассылок"
-
-    def __str__(self):
-        return f"{self.mailing} → {self.recipient} ({self.status})"
+from .personalization import validate_placeholders
 
 
 class Client(models.Model):
@@ -43,15 +23,26 @@ class Recipient(models.Model):
     class Meta:
         verbose_name = 'Получатель'
         verbose_name_plural = 'Получатели'
+        indexes = [
+            # Списки по владельцу с курсором (owner_id, id)
+            models.Index(fields=['owner', 'id'], name='recipient_owner_id'),
+            # Импорт ищет существующие адреса без учёта регистра
+            models.Index(Lower('email'), name='recipient_email_lower'),
+        ]
 
     def __str__(self):
         return self.full_name
 
 
 class Message(models.Model):
-    subject = models.CharField("Тема", max_length=255)
-    body = models.TextField("Тело сообщения")
+    subject = models.CharField("Тема", max_length=255, validators=[validate_placeholders],
+                               help_text="Можно использовать {{ full_name }} и {{ email }} получателя")
+    body = models.TextField("Тело сообщения", validators=[validate_placeholders])
+    html_body = models.TextField("HTML-версия", blank=True, validators=[validate_placeholders],
+                                 help_text="Необязательно: письмо уйдёт как multipart с текстом и HTML")
     created_at = models.DateTimeField("Дата создания", auto_now_add=True)
+    # Часть ключа кэша скомпилированных шаблонов (mailing.personalization)
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
     owner = models.ForeignKey('users.CustomUser', on_delete=models.CASCADE, null=True, blank=True)
 
     def __str__(self):
@@ -60,6 +51,9 @@ class Message(models.Model):
     class Meta:
         verbose_name = 'Сообщение'
         verbose_name_plural = 'Сообщения'
+        indexes = [
+            models.Index(fields=['owner', 'id'], name='message_owner_id'),
+        ]
 
 
 class MailingStatus(models.TextChoices):
@@ -83,94 +77,229 @@ class Mailing(models.Model):
     recipients = models.ManyToManyField('Recipient')
     owner = models.ForeignKey('users.CustomUser', on_delete=models.CASCADE, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Планировщик: наступившие рассылки в статусе «создана»
+            models.Index(fields=['status', 'start_datetime'], name='mailing_status_start'),
+            models.Index(fields=['owner', 'id'], name='mailing_owner_id'),
+        ]
+
     def get_recipients(self):
         return Client.objects.all()
 
     def __str__(self):
         return f"Mailing {self.subject} - {self.status}"
 
-    def update_status(self):
-        now_time = timezone.now()
-        if now_time < self.start_datetime:
-            self.status = 'created'
-        elif self.start_datetime <= now_time <= self.end_datetime:
-            if self.status != 'started':
-                self.status = 'started'
-        elif now_time > self.end_datetime:
-            self.status = 'completed'
-        self.save()
+    @classmethod
+    def refresh_statuses(cls, now=None):
+        """Завершает рассылки с прошедшим end_datetime двумя UPDATE ... WHERE.
+
+        В «Запущена» рассылку переводит только запуск (scheduler.launch_due_mailings) вместе с
+        постановкой в очередь — иначе она осталась бы запущенной без задачи отправки. Рассылку, шарды
+        которой ещё в очереди или в работе, завершит последний шард (tasks.finish_job).
+        Возвращает число изменённых строк по каждому переходу.
+        """
+        now = now or timezone.now()
+        idle = cls.objects.filter(end_datetime__lt=now).exclude(models.Exists(DeliveryJob.objects.filter(
+            mailing=models.OuterRef('pk'), kind='send', status__in=DeliveryJob.ACTIVE_STATUSES)))
+        return {
+            'started_to_completed': idle.filter(status='started').update(status='completed'),
+            'created_to_completed': idle.filter(status='created').update(status='completed'),
+        }
 
     def complete_sending(self):
         self.status = 'completed'
-        self.save()
-
-    def update_statistics(self):
-        attempts = DeliveryAttempt.objects.filter(mailing=self)
-        total_attempts = attempts.count()
-        successful_attempts = attempts.filter(status='success').count()
-        failed_attempts = attempts.filter(status='failed').count()
-        sent_messages = successful_attempts
-
-        stats, created = MailingStatistics.objects.get_or_create(mailing=self)
-        stats.total_attempts = total_attempts
-        stats.successful_attempts = successful_attempts
-        stats.failed_attempts = failed_attempts
-        stats.sent_messages = sent_messages
-        stats.status = 'success' if successful_attempts > 0 and failed_attempts == 0 else 'failed' if failed_attempts > 0 else 'pending'
-        stats.save()
-
-
-def send_mailing(mailing):
-    recipients = mailing.recipients.all()
-    logger.info(f"Начинаем отправку для {len(recipients)} получателей")
-
-    for recipient in recipients:
-        try:
-            logger.info(f"Отправка на {recipient.email}")
-            send_mail(
-                mailing.message.subject,
-                mailing.message.body,
-                settings.DEFAULT_FROM_EMAIL,
-                [recipient.email],
-                fail_silently=False,
-            )
-            logger.info(f"Успешно отправлено на {recipient.email}")
-            DeliveryAttempt.create_attempt(mailing, recipient, 'success', 'Email sent successfully')
-        except Exception as e:
-            logger.error(f"Ошибка для {recipient.email}: {str(e)}")
-            DeliveryAttempt.create_attempt(mailing, recipient, 'failed', str(e))
-
-    mailing.complete_sending()
-    mailing.update_statistics()
+        self.save(update_fields=['status'])
+
+
+class MailingCounters(models.Model):
+    mailing = models.OneToOneField(Mailing, on_delete=models.CASCADE, primary_key=True, related_name='counters')
+    total_attempts = models.PositiveIntegerField(default=0)
+    successful_attempts = models.PositiveIntegerField(default=0)
+    failed_attempts = models.PositiveIntegerField(default=0)
+    suppressed_attempts = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    # Текущий запуск: получателей в рассылке, начало и сколько получателей было обработано до него
+    recipients_total = models.PositiveIntegerField(default=0)
+    run_started_at = models.DateTimeField(null=True, blank=True)
+    run_base = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики рассылки'
+        verbose_name_plural = 'Счётчики рассылок'
+        indexes = [
+            models.Index(fields=['-updated_at'], name='counters_updated_at'),
+        ]
+
+    def __str__(self):
+        return f"{self.mailing}: {self.successful_attempts}/{self.total_attempts}"
+
+    @property
+    def sent_messages(self):
+        return self.successful_attempts
+
+    @property
+    def status(self):
+        if self.failed_attempts > 0:
+            return 'failed'
+        if self.successful_attempts > 0:
+            return 'success'
+        return 'pending'
+
+    @classmethod
+    def increment(cls, mailing_id, successful=0, failed=0, suppressed=0):
+        """Атомарно прибавляет к счётчикам рассылки, не читая их и не пересчитывая попытки."""
+        cls.objects.bulk_create([cls(mailing_id=mailing_id)], ignore_conflicts=True)
+        cls.objects.filter(mailing_id=mailing_id).update(
+            total_attempts=models.F('total_attempts') + successful + failed,
+            successful_attempts=models.F('successful_attempts') + successful,
+            failed_attempts=models.F('failed_attempts') + failed,
+            suppressed_attempts=models.F('suppressed_attempts') + suppressed,
+            updated_at=timezone.now(),
+        )
+
+    @classmethod
+    def start_run(cls, mailing_id, recipients_total):
+        """Отмечает начало прохода рассылки: от этой точки считаются скорость и оставшееся время."""
+        now = timezone.now()
+        cls.objects.bulk_create([cls(mailing_id=mailing_id)], ignore_conflicts=True)
+        cls.objects.filter(mailing_id=mailing_id).update(
+            recipients_total=recipients_total,
+            run_started_at=now,
+            run_base=models.F('successful_attempts') + models.F('failed_attempts') + models.F('suppressed_attempts'),
+            updated_at=now,
+        )
 
 
 class DeliveryAttempt(models.Model):
     STATUS_CHOICES = [
         ('success', 'Успешно'),
         ('failed', 'Не успешно'),
+        ('deferred', 'Отложено'),
+        ('suppressed', 'Не отправлено: адрес в списке подавления'),
     ]
 
     mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE)
     recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE)
     attempt_time = models.DateTimeField(default=timezone.now)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    # Номер попытки для получателя в рамках рассылки: 1 — первый проход, дальше — повторы
+    attempt_number = models.PositiveSmallIntegerField(default=1)
     server_response = models.TextField(null=True, blank=True)
 
+    class Meta:
+        # На PostgreSQL таблица секционирована по месяцам attempt_time (миграция 0007, секции —
+        # mailing.partitions); там же BRIN-индекс по attempt_time
+        indexes = [
+            models.Index(fields=['mailing', 'status'], name='attempt_mailing_status'),
+        ]
+
     def __str__(self):
         return f"Attempt {self.id} - {self.status} for Mailing {self.mailing.id} to {self.recipient.email}"
 
-    @staticmethod
-    def create_attempt(mailing, recipient, status, response=None):
-        try:
-            attempt = DeliveryAttempt(
-                mailing=mailing,
-                recipient=recipient,
-                status=status,
-                server_response=response
-            )
-            attempt.save()
-            logger.info(f"Успешно создана запись DeliveryAttempt с ID: {attempt.id}")
-            return attempt
-        except Exception as e:
-            logger.error(f"Ошибка при создании записи DeliveryAttempt: {str(e)}")
-            raise
+
+class DeliveryState(models.Model):
+    """Итог доставки получателю в рамках рассылки: по нему повторный запуск пропускает готовых."""
+    # Получатель обработан окончательно; deferred ждёт повтора
+    FINAL_STATUSES = ('success', 'failed', 'suppressed')
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name='delivery_states')
+    recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=10, choices=DeliveryAttempt.STATUS_CHOICES)
+    attempt_number = models.PositiveSmallIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Состояние доставки'
+        verbose_name_plural = 'Состояния доставки'
+        constraints = [
+            models.UniqueConstraint(fields=['mailing', 'recipient'], name='delivery_state_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.mailing_id} → {self.recipient_id}: {self.status}"
+
+
+class SuppressedAddress(models.Model):
+    """Адрес, на который не отправляем: несуществующий ящик, отписка, жалоба. Email хранится в нижнем регистре."""
+    REASON_CHOICES = [
+        ('bounce', 'Адрес не существует'),
+        ('unsubscribe', 'Отписка'),
+        ('complaint', 'Жалоба на спам'),
+        ('manual', 'Добавлен вручную'),
+    ]
+
+    email = models.EmailField(unique=True)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default='manual')
+    comment = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Заблокированный адрес'
+        verbose_name_plural = 'Список подавления'
+
+    def __str__(self):
+        return f"{self.email} ({self.reason})"
+
+
+class DeliveryJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+        ('canceled', 'Отменена'),
+    ]
+    # Задачи, которые ещё будут выполнены: по ним не ставят шарды повторно и не завершают рассылку
+    ACTIVE_STATUSES = ('queued', 'running')
+    KIND_CHOICES = [
+        ('send', 'Отправка'),
+        ('retry', 'Повтор'),
+    ]
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='send')
+    # Повтор: кому отправить снова, какой это номер попытки и не раньше какого времени
+    recipient_ids = models.JSONField(null=True, blank=True)
+    attempt_number = models.PositiveSmallIntegerField(default=1)
+    run_after = models.DateTimeField(null=True, blank=True)
+    # Шард отправки: получатели с id в [range_start, range_end); None — без границы с этой стороны
+    range_start = models.BigIntegerField(null=True, blank=True)
+    range_end = models.BigIntegerField(null=True, blank=True)
+    # Получателей в задаче при постановке в очередь и сколько из них уже обработано
+    recipients_total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    # Продлевается после каждой записанной пачки и в фоне, пока воркер жив; по нему находят задачи упавших воркеров
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Задача отправки'
+        verbose_name_plural = 'Задачи отправки'
+        indexes = [
+            # Воркер забирает только задачи в очереди — частичный индекс остаётся маленьким
+            models.Index(fields=['created_at'], condition=models.Q(status='queued'), name='job_queued_created'),
+            models.Index(fields=['mailing', 'status'], name='job_mailing_status'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} - {self.kind} {self.status} for Mailing {self.mailing_id}"
+
+
+class RateLimitBucket(models.Model):
+    """Ведро токенов ограничителя скорости отправки, общее для всех процессов (mailing.ratelimit)."""
+    key = models.CharField(max_length=255, primary_key=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Лимит отправки'
+        verbose_name_plural = 'Лимиты отправки'
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.1f}"
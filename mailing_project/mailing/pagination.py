@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.db.models import F, Q
+from django.http import Http404, JsonResponse, QueryDict
+
+
+def encode_cursor(obj):
+    owner_id = '' if obj.owner_id is None else obj.owner_id
+    return f"{owner_id}-{obj.pk}"
+
+
+def decode_cursor(value):
+    try:
+        owner_id, pk = value.split('-')
+        return (int(owner_id) if owner_id else None), int(pk)
+    except ValueError:
+        raise Http404("Некорректный курсор страницы")
+
+
+def after_cursor(owner_id, pk):
+    # Порядок (owner_id NULLS LAST, id): строки без владельца идут в самом конце
+    if owner_id is None:
+        return Q(owner__isnull=True, pk__gt=pk)
+    return Q(owner_id__gt=owner_id) | Q(owner_id=owner_id, pk__gt=pk) | Q(owner__isnull=True)
+
+
+class KeysetPaginationMixin:
+    """Постраничный вывод ListView по ключу (owner_id, id) вместо OFFSET.
+
+    Следующая страница запрашивается параметром ?after=<курсор>; ссылка на неё (next_page_query)
+    сохраняет page_size. Запрос с заголовком HX-Request получает только карточки
+    (partial_template_name), ?format=json — JSON.
+    """
+    partial_template_name = None
+    json_fields = ()
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET.get('page_size', settings.MAILING_PAGE_SIZE))
+        except ValueError:
+            page_size = settings.MAILING_PAGE_SIZE
+        return max(1, min(page_size, settings.MAILING_MAX_PAGE_SIZE))
+
+    def paginate_keyset(self, queryset):
+        page_size = self.get_page_size()
+        queryset = queryset.order_by(F('owner_id').asc(nulls_last=True), 'pk')
+        cursor = self.request.GET.get('after')
+        if cursor:
+            queryset = queryset.filter(after_cursor(*decode_cursor(cursor)))
+        rows = list(queryset[:page_size + 1])
+        next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+        return rows[:page_size], next_cursor
+
+    def next_page_query(self, next_cursor):
+        params = QueryDict(mutable=True)
+        params['after'] = next_cursor
+        if 'page_size' in self.request.GET:
+            params['page_size'] = self.get_page_size()
+        return params.urlencode()
+
+    def get_context_data(self, **kwargs):
+        page, next_cursor = self.paginate_keyset(self.object_list)
+        context = super().get_context_data(object_list=page, **kwargs)
+        context['next_cursor'] = next_cursor
+        context['next_page_query'] = self.next_page_query(next_cursor) if next_cursor else None
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get('format') == 'json':
+            return JsonResponse({
+                'results': [{field: getattr(obj, field) for field in self.json_fields}
+                            for obj in context['object_list']],
+                'next': context['next_cursor'],
+            })
+        if self.request.headers.get('HX-Request') and self.partial_template_name:
+            self.template_name = self.partial_template_name
+        return super().render_to_response(context, **response_kwargs)
@@ -0,0 +1,138 @@
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ATTEMPT_TABLE = 'mailing_deliveryattempt'
+PARTITION_PREFIX = f'{ATTEMPT_TABLE}_p'
+# Сюда попадают попытки месяцев, для которых секцию ещё не создали (миграция 0007)
+DEFAULT_PARTITION = f'{ATTEMPT_TABLE}_default'
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def is_partitioned(cursor):
+    if connection.vendor != 'postgresql':
+        return False
+    cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [ATTEMPT_TABLE])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def table_exists(cursor, name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+    return cursor.fetchone()[0]
+
+
+def create_partition(cursor, month):
+    """Создаёт секцию месяца.
+
+    Если секцию вовремя не создали, попытки этого месяца уже лежат в секции DEFAULT, и CREATE TABLE
+    ... PARTITION OF не пройдёт. Тогда в одной транзакции DEFAULT отсоединяется, создаётся секция,
+    строки месяца переносятся в неё, и DEFAULT присоединяется обратно. Пока идёт перенос, запись
+    в таблицу попыток ждёт блокировку.
+    """
+    name = partition_name(month)
+    if table_exists(cursor, name):
+        return name
+    bounds = [month, add_months(month, 1)]
+    with transaction.atomic():
+        misplaced = table_exists(cursor, DEFAULT_PARTITION)
+        if misplaced:
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" '
+                           f'WHERE attempt_time >= %s AND attempt_time < %s)', bounds)
+            misplaced = cursor.fetchone()[0]
+        if misplaced:
+            cursor.execute(f'ALTER TABLE "{ATTEMPT_TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"')
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{ATTEMPT_TABLE}" '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            bounds,
+        )
+        if misplaced:
+            cursor.execute(f'INSERT INTO "{name}" SELECT * FROM "{DEFAULT_PARTITION}" '
+                           f'WHERE attempt_time >= %s AND attempt_time < %s', bounds)
+            cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE attempt_time >= %s AND attempt_time < %s',
+                           bounds)
+            cursor.execute(f'ALTER TABLE "{ATTEMPT_TABLE}" ATTACH PARTITION "{DEFAULT_PARTITION}" DEFAULT')
+            logger.warning(f"Попытки доставки за {month:%Y-%m} перенесены из {DEFAULT_PARTITION} в секцию {name}")
+    return name
+
+
+def ensure_attempt_partitions(months_ahead=None, now=None):
+    """Создаёт месячные секции DeliveryAttempt на текущий и months_ahead следующих месяцев.
+
+    Ошибка создания секции записывается в лог и не прерывает вызывающего (планировщик, воркер):
+    попытки пишутся в DEFAULT, а секцию попробуют создать на следующем вызове.
+    """
+    months_ahead = settings.MAILING_ATTEMPT_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    current = month_start(now or timezone.now())
+    created = []
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return []
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            try:
+                created.append(create_partition(cursor, month))
+            except DatabaseError as e:
+                logger.error(f"Не удалось создать секцию {partition_name(month)}: {str(e)}")
+    return created
+
+
+def attempt_partitions():
+    """Месячные секции DeliveryAttempt: список (месяц, имя таблицы) по возрастанию."""
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return []
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s AND child.relname LIKE %s",
+            [ATTEMPT_TABLE, f'{PARTITION_PREFIX}%'],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        suffix = name[len(PARTITION_PREFIX):]
+        if len(suffix) == 6 and suffix.isdigit():
+            partitions.append((datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=dt_timezone.utc), name))
+    return sorted(partitions)
+
+
+def prune_attempt_partitions(keep_months=None, archive=False, now=None):
+    """Убирает секции старше keep_months месяцев: DROP TABLE или DETACH (архив остаётся таблицей).
+
+    Стоимость не зависит от числа строк, в отличие от DELETE.
+    """
+    keep_months = settings.MAILING_ATTEMPT_RETENTION_MONTHS if keep_months is None else keep_months
+    cutoff = add_months(month_start(now or timezone.now()), -keep_months)
+    pruned = []
+    with connection.cursor() as cursor:
+        for month, name in attempt_partitions():
+            if month >= cutoff:
+                continue
+            if archive:
+                cursor.execute(f'ALTER TABLE "{ATTEMPT_TABLE}" DETACH PARTITION "{name}"')
+            else:
+                cursor.execute(f'DROP TABLE "{name}"')
+            logger.info(f"Секция {name} {'отсоединена в архив' if archive else 'удалена'}")
+            pruned.append(name)
+    return pruned
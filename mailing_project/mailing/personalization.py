@@ -0,0 +1,93 @@
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.html import escape
+
+# Подстановки в теме и тексте сообщения: {{ full_name }}, {{ email }}
+PLACEHOLDER_RE = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+PLACEHOLDERS = ('full_name', 'email')
+
+
+def validate_placeholders(text):
+    unknown = sorted({name for name in PLACEHOLDER_RE.findall(text) if name not in PLACEHOLDERS})
+    if unknown:
+        raise ValidationError(
+            f"Неизвестные подстановки: {', '.join(unknown)}. Доступны: "
+            + ', '.join(f'{{{{ {name} }}}}' for name in PLACEHOLDERS)
+        )
+
+
+class CompiledTemplate:
+    """Текст, разобранный один раз: литералы и имена подстановок собраны в строку для str.format_map.
+
+    Подстановка на получателя — один вызов format_map, без повторного разбора шаблона.
+    """
+    __slots__ = ('source', 'format_string', 'fields')
+
+    def __init__(self, source):
+        validate_placeholders(source)
+        parts = PLACEHOLDER_RE.split(source)
+        # re.split с группой: чётные элементы — текст, нечётные — имена подстановок
+        self.source = source
+        self.fields = tuple(parts[1::2])
+        self.format_string = ''.join(
+            part.replace('{', '{{').replace('}', '}}') if index % 2 == 0 else f'{{{part}}}'
+            for index, part in enumerate(parts)
+        )
+
+    def render(self, values):
+        if not self.fields:
+            return self.source
+        return self.format_string.format_map(values)
+
+
+class CompiledMessage:
+    __slots__ = ('subject', 'body', 'html_body')
+
+    def __init__(self, subject, body, html_body=''):
+        self.subject = CompiledTemplate(subject)
+        self.body = CompiledTemplate(body)
+        self.html_body = CompiledTemplate(html_body or '')
+
+    @property
+    def is_static(self):
+        # Без подстановок письмо у всех получателей одинаковое, кроме заголовков To и Message-ID
+        return not (self.subject.fields or self.body.fields or self.html_body.fields)
+
+    def render(self, recipient):
+        """(тема, текст, HTML) для получателя; в HTML значения экранируются."""
+        values = recipient_values(recipient)
+        html = ''
+        if self.html_body.source:
+            html = self.html_body.render({name: escape(value) for name, value in values.items()})
+        return self.subject.render(values), self.body.render(values), html
+
+
+def recipient_values(recipient):
+    return {'full_name': getattr(recipient, 'full_name', '') or '', 'email': recipient.email}
+
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def compiled_message(message):
+    """Скомпилированное сообщение из кэша процесса по (id, updated_at): правка сообщения меняет ключ."""
+    html_body = getattr(message, 'html_body', '')
+    if getattr(message, 'pk', None) is None:
+        return CompiledMessage(message.subject, message.body, html_body)
+    key = (message.pk, message.updated_at)
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+    compiled = CompiledMessage(message.subject, message.body, html_body)
+    with _compiled_lock:
+        _compiled[key] = compiled
+        while len(_compiled) > settings.MAILING_TEMPLATE_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return compiled
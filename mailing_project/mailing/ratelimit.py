@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+# rate — писем в секунду, burst — сколько можно отправить разом после простоя
+RateLimit = namedtuple('RateLimit', ['rate', 'burst'])
+
+
+def refill(tokens, elapsed, limit):
+    return min(limit.burst, tokens + max(elapsed, 0) * limit.rate)
+
+
+def grant_tokens(buckets, limits, count):
+    """Списывает до count токенов сразу со всех вёдер: (выдано, сколько ждать следующего токена)."""
+    granted = min(count, *(int(buckets[key]) for key in limits))
+    for key in limits:
+        buckets[key] -= granted
+    if granted:
+        return granted, 0
+    return 0, max((1 - buckets[key]) / limit.rate for key, limit in limits.items())
+
+
+class DatabaseRateLimiter:
+    """Вёдра токенов в таблице RateLimitBucket: лимит один на все воркеры, которые смотрят в эту БД."""
+
+    def acquire(self, limits, count):
+        now = timezone.now()
+        keys = sorted(limits)
+        with transaction.atomic():
+            RateLimitBucket.objects.bulk_create(
+                [RateLimitBucket(key=key, tokens=limits[key].burst, updated_at=now) for key in keys],
+                ignore_conflicts=True,
+            )
+            # Блокируем строки в одном порядке, чтобы воркеры не ждали друг друга по кругу
+            rows = list(RateLimitBucket.objects.select_for_update().filter(key__in=keys).order_by('key'))
+            buckets = {row.key: refill(row.tokens, (now - row.updated_at).total_seconds(), limits[row.key])
+                       for row in rows}
+            result = grant_tokens(buckets, limits, count)
+            for row in rows:
+                row.tokens = buckets[row.key]
+                row.updated_at = now
+            RateLimitBucket.objects.bulk_update(rows, ['tokens', 'updated_at'])
+        return result
+
+
+class LocalRateLimiter:
+    """Вёдра в памяти процесса — для разработки и одного воркера."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, limits, count):
+        now = time.monotonic()
+        with self.lock:
+            buckets = {}
+            for key, limit in limits.items():
+                tokens, updated_at = self.buckets.get(key, (limit.burst, now))
+                buckets[key] = refill(tokens, now - updated_at, limit)
+            result = grant_tokens(buckets, limits, count)
+            for key, tokens in buckets.items():
+                self.buckets[key] = (tokens, now)
+        return result
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Ограничитель из MAILING_RATE_LIMITER (путь к классу); None — без ограничения."""
+    global _limiter
+    if not settings.MAILING_RATE_LIMITER:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = import_string(settings.MAILING_RATE_LIMITER)()
+    return _limiter
+
+
+def configured_limit(name):
+    """Лимит из настройки name: (писем в секунду, ёмкость ведра) или None — без ограничения.
+
+    При rate <= 0 ведро не пополняется, при burst < 1 в нём не бывает целого токена — Throttle.wait
+    ждал бы вечно, поэтому такие значения — ImproperlyConfigured.
+    """
+    value = getattr(settings, name)
+    if not value:
+        return None
+    try:
+        limit = RateLimit(*value)
+        valid = limit.rate > 0 and limit.burst >= 1
+    except TypeError:
+        valid = False
+    if not valid:
+        raise ImproperlyConfigured(f"{name} должен быть (rate > 0, burst >= 1), а не {value!r}")
+    return limit
+
+
+def check_limits():
+    # Вызывается при запуске приложения (ClientsConfig.ready): ошибка в настройках видна сразу
+    for name in ('MAILING_HOST_RATE_LIMIT', 'MAILING_OWNER_RATE_LIMIT'):
+        configured_limit(name)
+
+
+def mailing_limits(mailing):
+    """Вёдра для рассылки: общее на SMTP-сервер и своё у каждого владельца."""
+    limits = {}
+    host_limit = configured_limit('MAILING_HOST_RATE_LIMIT')
+    if host_limit:
+        limits[f"host:{settings.EMAIL_HOST}"] = host_limit
+    owner_limit = configured_limit('MAILING_OWNER_RATE_LIMIT')
+    if owner_limit:
+        limits[f"owner:{mailing.owner_id}"] = owner_limit
+    return limits
+
+
+class Throttle:
+    """Запас токенов одной пачки: за токенами к ограничителю ходим партиями, а не за каждым письмом."""
+
+    def __init__(self, limiter, limits, grant_size=None):
+        self.limiter = limiter
+        self.limits = limits
+        self.grant_size = grant_size or settings.MAILING_RATE_LIMIT_GRANT
+        self.tokens = 0
+
+    def take(self):
+        """Берёт токен из уже полученного запаса, не обращаясь к ограничителю; False — запас кончился."""
+        if self.limiter is None or not self.limits:
+            return True
+        if self.tokens:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait(self, remaining=1):
+        """Блокирует поток, пока не будет токена на одно письмо; remaining — сколько писем ещё впереди."""
+        if self.take():
+            return
+        while not self.tokens:
+            granted, delay = self.limiter.acquire(self.limits, min(remaining, self.grant_size))
+            if granted:
+                self.tokens = granted
+                break
+            logger.debug(f"Лимит отправки исчерпан, ждём {delay:.2f} с")
+            time.sleep(delay)
+        self.tokens -= 1
@@ -0,0 +1,60 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .events import publish
+from .models import Mailing
+from .partitions import ensure_attempt_partitions
+from .tasks import send_mailing_task
+
+logger = logging.getLogger(__name__)
+
+
+def launch_due_mailings(now=None, limit=100):
+    """Переводит наступившие рассылки в «Запущена» и ставит их в очередь отправки.
+
+    Строки блокируются с SKIP LOCKED, поэтому несколько планировщиков на разных узлах
+    не запустят одну рассылку дважды.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = list(Mailing.objects
+                   .select_for_update(skip_locked=True)
+                   .filter(status='created', start_datetime__lte=now, end_datetime__gte=now)
+                   .order_by('start_datetime')
+                   .values_list('pk', flat=True)[:limit])
+        if not due:
+            return []
+        Mailing.objects.filter(pk__in=due, status='created').update(status='started')
+        for mailing_id in due:
+            send_mailing_task(mailing_id)
+            publish(mailing_id, 'status', {'status': 'started'})
+    logger.info(f"Запущено рассылок по расписанию: {len(due)}")
+    return due
+
+
+def seconds_until_next_start(now=None, default=None):
+    """Сколько ждать до ближайшего старта, чтобы не опрашивать таблицу впустую."""
+    now = now or timezone.now()
+    next_start = Mailing.objects.filter(status='created', start_datetime__gt=now).aggregate(
+        next_start=Min('start_datetime'))['next_start']
+    if next_start is None:
+        return default
+    seconds = (next_start - now).total_seconds()
+    return seconds if default is None else min(seconds, default)
+
+
+def run_scheduler_once(now=None):
+    now = now or timezone.now()
+    # Секции попыток доставки создаются заранее, до того как в них начнут писать; ошибка
+    # создания секции пишется в лог и проход не прерывает
+    ensure_attempt_partitions(now=now)
+    launched = launch_due_mailings(now)
+    # Наступившие рассылки сверх лимита прохода остаются в «Создана» до следующего прохода;
+    # здесь — только завершения
+    changed = Mailing.refresh_statuses(now)
+    if any(changed.values()):
+        logger.info(f"Обновлены статусы рассылок: {changed}")
+    return launched, changed
@@ -0,0 +1,164 @@
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .cache import get_progress_snapshot
+from .models import DeliveryAttempt, DeliveryJob, Mailing, MailingCounters
+
+RECENT_ATTEMPTS_LIMIT = 50
+
+
+def _visible(queryset, user, owner_field):
+    if user.is_manager():
+        return queryset
+    return queryset.filter(**{owner_field: user})
+
+
+def mailing_totals(user):
+    """Итоги по каждой рассылке одним запросом (счётчики + тема рассылки через JOIN)."""
+    rows = (_visible(MailingCounters.objects, user, 'mailing__owner')
+            .order_by('-updated_at')
+            .values('mailing_id', 'total_attempts', 'successful_attempts', 'failed_attempts', 'updated_at',
+                    subject=F('mailing__subject'), status=F('mailing__status')))
+    return list(rows)
+
+
+def owner_summary(user):
+    """Сводка владельца (или всей системы для менеджера): рассылки по статусам и итоги доставки."""
+    mailings = _visible(Mailing.objects, user, 'owner').aggregate(
+        mailings=Count('id'),
+        created=Count('id', filter=Q(status='created')),
+        started=Count('id', filter=Q(status='started')),
+        completed=Count('id', filter=Q(status='completed')),
+    )
+    attempts = _visible(MailingCounters.objects, user, 'mailing__owner').aggregate(
+        total_attempts=Coalesce(Sum('total_attempts'), 0),
+        successful_attempts=Coalesce(Sum('successful_attempts'), 0),
+        failed_attempts=Coalesce(Sum('failed_attempts'), 0),
+    )
+    return {**mailings, **attempts}
+
+
+def owner_totals(user):
+    """Итоги доставки в разрезе владельцев; для обычного пользователя — одна строка."""
+    rows = (_visible(MailingCounters.objects, user, 'mailing__owner')
+            .values(owner_email=F('mailing__owner__email'))
+            .annotate(mailings=Count('mailing_id'),
+                      total_attempts=Sum('total_attempts'),
+                      successful_attempts=Sum('successful_attempts'),
+                      failed_attempts=Sum('failed_attempts'))
+            .order_by('-total_attempts'))
+    return list(rows)
+
+
+def mailing_summary(mailing):
+    row = (MailingCounters.objects
+           .filter(mailing=mailing)
+           .values('total_attempts', 'successful_attempts', 'failed_attempts', 'updated_at')
+           .first())
+    return row or {'total_attempts': 0, 'successful_attempts': 0, 'failed_attempts': 0, 'updated_at': None}
+
+
+def daily_totals(mailing):
+    """Попытки рассылки по дням: один GROUP BY с условной агрегацией по статусу."""
+    rows = (DeliveryAttempt.objects
+            .filter(mailing=mailing)
+            .annotate(day=TruncDate('attempt_time'))
+            .values('day')
+            .annotate(total=Count('id'),
+                      successful=Count('id', filter=Q(status='success')),
+                      failed=Count('id', filter=Q(status='failed')),
+                      deferred=Count('id', filter=Q(status='deferred')))
+            .order_by('day'))
+    return list(rows)
+
+
+def recent_attempts(mailing, limit=RECENT_ATTEMPTS_LIMIT):
+    rows = (DeliveryAttempt.objects
+            .filter(mailing=mailing)
+            .order_by('-attempt_time')
+            .values('status', 'attempt_number', 'attempt_time', 'server_response',
+                    email=F('recipient__email'))[:limit])
+    return list(rows)
+
+
+PROGRESS_FIELDS = ('successful_attempts', 'failed_attempts', 'suppressed_attempts', 'recipients_total',
+                   'run_started_at', 'run_base', 'updated_at')
+
+
+def progress_snapshot(mailing_id):
+    """Счётчики рассылки для хода отправки: один запрос по первичному ключу, попытки не пересчитываются."""
+    row = (MailingCounters.objects
+           .filter(mailing_id=mailing_id)
+           .values(*PROGRESS_FIELDS, status=F('mailing__status'), owner_id=F('mailing__owner_id'))
+           .first())
+    if row is None:
+        # Счётчиков нет, пока рассылку не начали отправлять
+        mailing = Mailing.objects.filter(pk=mailing_id).values('status', 'owner_id').first()
+        if mailing is None:
+            return None
+        row = {'successful_attempts': 0, 'failed_attempts': 0, 'suppressed_attempts': 0, 'recipients_total': 0,
+               'run_started_at': None, 'run_base': 0, 'updated_at': None, **mailing}
+    row['shards'] = shard_totals(mailing_id, row['run_started_at'])
+    return row
+
+
+def shard_totals(mailing_id, run_started_at):
+    """Шарды текущего прохода по статусам и сколько получателей в них обработано."""
+    totals = {'total': 0, 'processed': 0, **{status: 0 for status, label in DeliveryJob.STATUS_CHOICES}}
+    if run_started_at is None:
+        return totals
+    rows = (DeliveryJob.objects
+            .filter(mailing_id=mailing_id, kind='send', created_at__gte=run_started_at)
+            .values('status')
+            .annotate(count=Count('id'), processed=Sum('processed')))
+    for row in rows:
+        totals[row['status']] = row['count']
+        totals['total'] += row['count']
+        totals['processed'] += row['processed']
+    return totals
+
+
+def mailing_progress(mailing_id, user):
+    """Ход отправки рассылки; None — рассылки нет среди видимых пользователю.
+
+    Снимок счётчиков берётся из кэша (сбрасывается при записи каждой пачки попыток), так что частый
+    опрос множеством вкладок не доходит до БД.
+    """
+    row = get_progress_snapshot(mailing_id, progress_snapshot)
+    if row is None or not (user.is_manager() or row['owner_id'] == user.pk):
+        return None
+    return progress_data(mailing_id, row)
+
+
+def current_progress(mailing_id):
+    """Ход отправки без проверки прав — для событий, которые публикует воркер."""
+    row = get_progress_snapshot(mailing_id, progress_snapshot)
+    return progress_data(mailing_id, row) if row is not None else None
+
+
+def progress_data(mailing_id, row):
+    processed = row['successful_attempts'] + row['failed_attempts'] + row['suppressed_attempts']
+    pending = max(row['recipients_total'] - processed, 0)
+    rate = eta = None
+    if row['run_started_at'] is not None:
+        # Скорость по пачкам текущего запуска: от его начала до последней записанной пачки
+        elapsed = (row['updated_at'] - row['run_started_at']).total_seconds()
+        done_in_run = processed - row['run_base']
+        if elapsed > 0 and done_in_run > 0:
+            rate = done_in_run / elapsed
+            eta = pending / rate
+    return {
+        'mailing_id': mailing_id,
+        'status': row['status'],
+        'total': row['recipients_total'],
+        'sent': row['successful_attempts'],
+        'failed': row['failed_attempts'],
+        'suppressed': row['suppressed_attempts'],
+        'pending': pending,
+        'rate_per_second': round(rate, 2) if rate is not None else None,
+        'eta_seconds': round(eta) if eta is not None else None,
+        'shards': row['shards'],
+        'updated_at': row['updated_at'],
+        'now': timezone.now(),
+    }
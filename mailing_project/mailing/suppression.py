@@ -0,0 +1,49 @@
+import logging
+
+from django.db.models.functions import Lower
+
+from .models import SuppressedAddress
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+class SuppressionList:
+    """Заблокированные адреса для одного прохода рассылки: множество в памяти, проверка адреса за O(1)."""
+
+    def __init__(self, emails=()):
+        self.emails = set(emails)
+
+    @classmethod
+    def for_mailing(cls, mailing):
+        # Одним запросом и только пересечение с получателями рассылки: память зависит от размера
+        # рассылки, а не от размера списка подавления
+        recipient_emails = mailing.recipients.annotate(normalized=Lower('email')).values('normalized')
+        emails = (SuppressedAddress.objects
+                  .filter(email__in=recipient_emails)
+                  .values_list('email', flat=True)
+                  .iterator())
+        return cls(emails)
+
+    def __contains__(self, email):
+        return normalize_email(email) in self.emails
+
+    def __len__(self):
+        return len(self.emails)
+
+
+def suppress_addresses(emails, reason, comment='', batch_size=1000):
+    """Добавляет адреса в список подавления; уже заблокированные не трогает."""
+    emails = {normalize_email(email) for email in emails}
+    if not emails:
+        return 0
+    SuppressedAddress.objects.bulk_create(
+        [SuppressedAddress(email=email, reason=reason, comment=comment) for email in emails],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    logger.info(f"В список подавления ({reason}) добавлено адресов: {len(emails)}")
+    return len(emails)
@@ -0,0 +1,269 @@
+import logging
+import random
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .cache import reset_progress
+from .delivery import publish_progress, send_mailing
+from .events import publish
+from .models import DeliveryJob, Mailing, MailingCounters
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_JOB_STATUSES = DeliveryJob.ACTIVE_STATUSES
+
+
+def shard_ranges(mailing_id, shard_size=None):
+    """Делит получателей рассылки на шарды по shard_size: диапазоны id по таблице связи M2M.
+
+    Возвращает [(начало, конец, получателей)]. У первого шарда нет нижней границы, у последнего — верхней:
+    получатели, добавленные в рассылку после постановки в очередь, тоже попадут в какой-то шард.
+    """
+    shard_size = shard_size or settings.MAILING_SHARD_SIZE
+    links = Mailing.recipients.through.objects.filter(mailing_id=mailing_id)
+    total = links.count()
+    # Начало каждого следующего шарда — строка с номером 1 + k * shard_size в порядке id; считает БД,
+    # сюда приходят только границы
+    starts = list(links
+                  .annotate(position=Window(RowNumber(), order_by=F('recipient_id').asc()))
+                  .annotate(offset=(F('position') - 1) % shard_size)
+                  .filter(offset=0, position__gt=1)
+                  .order_by('recipient_id')
+                  .values_list('recipient_id', flat=True))
+    bounds = [None, *starts, None]
+    return [
+        (start, end, min(shard_size, total - index * shard_size))
+        for index, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+def send_mailing_task(mailing_id):
+    """Ставит рассылку в очередь на отправку шардами по MAILING_SHARD_SIZE и сразу возвращает их задачи.
+
+    Шарды независимо забирают воркеры на любых узлах; рассылка завершается, когда выполнены все шарды прохода.
+    """
+    with transaction.atomic():
+        # Блокировка строки рассылки, как в finish_job: из одновременных постановок в очередь шарды создаст
+        # только первая, остальные дождутся её коммита и увидят уже созданные
+        Mailing.objects.select_for_update().get(pk=mailing_id)
+        jobs = list(DeliveryJob.objects.filter(mailing_id=mailing_id, kind='send', status__in=ACTIVE_JOB_STATUSES))
+        if jobs:
+            logger.info(f"Рассылка {mailing_id} уже в очереди (шардов в работе: {len(jobs)})")
+            return jobs
+        ranges = shard_ranges(mailing_id)
+        # Начало прохода отмечается раньше создания шардов: по нему отличаем шарды этого прохода
+        MailingCounters.start_run(mailing_id, sum(size for start, end, size in ranges))
+        jobs = DeliveryJob.objects.bulk_create([
+            DeliveryJob(mailing_id=mailing_id, range_start=start, range_end=end, recipients_total=size)
+            for start, end, size in ranges
+        ])
+    reset_progress([mailing_id])
+    logger.info(f"Рассылка {mailing_id} поставлена в очередь: шардов {len(jobs)}")
+    return jobs
+
+
+def cancel_mailing(mailing_id):
+    """Отключает рассылку: завершает её и отменяет задачи в очереди и в работе.
+
+    Воркер, который уже отправляет шард или повтор, на следующем heartbeat получит LeaseLost и остановится.
+    Строка рассылки блокируется, как в finish_job: повтор, поставленный одновременно с отключением, тоже
+    будет отменён. Возвращает число отменённых задач.
+    """
+    with transaction.atomic():
+        mailing = Mailing.objects.select_for_update().get(pk=mailing_id)
+        mailing.complete_sending()
+        canceled = (DeliveryJob.objects.filter(mailing_id=mailing_id, status__in=ACTIVE_JOB_STATUSES)
+                    .update(status='canceled', finished_at=timezone.now()))
+    reset_progress([mailing_id])
+    logger.info(f"Рассылка {mailing_id} отключена, отменено задач: {canceled}")
+    return canceled
+
+
+def run_shards(mailing_id):
+    """Задачи-шарды текущего прохода рассылки: созданы после его начала (MailingCounters.run_started_at)."""
+    started = MailingCounters.objects.filter(mailing_id=mailing_id).values('run_started_at')[:1]
+    return DeliveryJob.objects.filter(mailing_id=mailing_id, kind='send', created_at__gte=started)
+
+
+def retry_delay(attempt_number):
+    """Пауза перед попыткой attempt_number: экспонента от MAILING_RETRY_BASE_DELAY со случайной половиной.
+
+    Джиттер разводит по времени повторы рассылок, которые упали одновременно.
+    """
+    delay = min(settings.MAILING_RETRY_MAX_DELAY, settings.MAILING_RETRY_BASE_DELAY * 2 ** (attempt_number - 2))
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def schedule_retry(mailing_id, recipient_ids, attempt_number):
+    """Ставит в очередь повтор для получателей с временной ошибкой; воркер возьмёт его после run_after."""
+    job = DeliveryJob.objects.create(
+        mailing_id=mailing_id,
+        kind='retry',
+        recipient_ids=list(recipient_ids),
+        recipients_total=len(recipient_ids),
+        attempt_number=attempt_number,
+        run_after=timezone.now() + retry_delay(attempt_number),
+    )
+    logger.info(f"Повтор {attempt_number} рассылки {mailing_id} для {len(recipient_ids)} получателей "
+                f"запланирован на {job.run_after:%Y-%m-%d %H:%M:%S} (задача {job.id})")
+    publish(mailing_id, 'retry_scheduled', {'job_id': job.id, 'attempt_number': attempt_number,
+                                            'recipients': len(recipient_ids), 'run_after': job.run_after})
+    return job
+
+
+def claim_job(worker):
+    """Забирает самую старую задачу из очереди; параллельные воркеры пропускают занятые строки."""
+    with transaction.atomic():
+        job = (DeliveryJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(Q(run_after__isnull=True) | Q(run_after__lte=timezone.now()), status='queued')
+               .order_by('created_at')
+               .first())
+        if job is None:
+            return None
+        job.status = 'running'
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.worker = worker
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at', 'worker'])
+    return job
+
+
+def requeue_stale_jobs(timeout=None):
+    """Возвращает в очередь задачи, воркер которых давно не отмечался (упал посреди отправки).
+
+    Живой воркер продлевает аренду в фоне (keep_alive), так что сюда попадают только задачи упавших
+    или отрезанных от БД воркеров. UPDATE снимает с задачи воркера: если прежний всё же жив, его
+    следующий heartbeat этого не найдёт, и он прекратит отправку (LeaseLost). Уже обработанных
+    получателей повторный запуск пропустит по DeliveryState.
+    """
+    timeout = timeout or settings.MAILING_JOB_STALE_TIMEOUT
+    stale = DeliveryJob.objects.filter(status='running', heartbeat_at__lt=timezone.now() - timedelta(seconds=timeout))
+    count = stale.update(status='queued', worker='')
+    if count:
+        logger.warning(f"Возвращено в очередь зависших задач: {count}")
+    return count
+
+
+class LeaseLost(Exception):
+    """Задачу вернули в очередь или отменили, пока воркер её выполнял: продолжать отправку нельзя."""
+
+    def __init__(self, job):
+        super().__init__(f"Задача {job.id} отменена или возвращена в очередь, воркер {job.worker or '—'} "
+                         f"её больше не ведёт")
+
+
+def leased(job):
+    # Строка задачи, пока она за этим воркером и не отменена: claim_job записывает воркера и время начала
+    return DeliveryJob.objects.filter(pk=job.pk, worker=job.worker, started_at=job.started_at,
+                                      status__in=ACTIVE_JOB_STATUSES)
+
+
+def heartbeat(job, processed=None):
+    """Продлевает аренду задачи; LeaseLost — задача уже не за этим воркером."""
+    fields = {'heartbeat_at': timezone.now()}
+    if processed is not None:
+        fields['processed'] = job.processed = processed
+    if not leased(job).update(**fields):
+        raise LeaseLost(job)
+
+
+@contextmanager
+def keep_alive(job, interval=None):
+    """Пока выполняется блок, фоновый поток продлевает аренду задачи раз в interval секунд.
+
+    Отметки после пачек не хватает: пачка на медленном SMTP или в ожидании лимита отправки может идти
+    дольше MAILING_JOB_STALE_TIMEOUT, и задачу отдали бы другому воркеру при живом прежнем.
+    """
+    interval = interval or settings.MAILING_JOB_HEARTBEAT_INTERVAL
+    stop = threading.Event()
+
+    def renew():
+        try:
+            while not stop.wait(interval):
+                try:
+                    heartbeat(job)
+                except LeaseLost as e:
+                    logger.warning(str(e))
+                    return
+                except DatabaseError as e:
+                    logger.error(f"Не удалось продлить аренду задачи {job.id}: {str(e)}")
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=renew, name=f'job-{job.pk}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    # Шард отправки ограничен диапазоном id, повтор — списком получателей
+    recipient_range = (job.range_start, job.range_end) if job.kind == 'send' else None
+    deferred = []
+    try:
+        # Задачу могли вернуть в очередь ещё до начала: тогда не отправляем ни одного письма
+        heartbeat(job)
+        with keep_alive(job):
+            deferred = send_mailing(job.mailing, job.recipient_ids, job.attempt_number,
+                                    heartbeat=lambda processed: heartbeat(job, processed),
+                                    recipient_range=recipient_range)
+        job.status = 'done'
+    except LeaseLost as e:
+        logger.warning(f"{str(e)}: отправка прервана")
+        return job
+    except Exception as e:
+        logger.exception(f"Ошибка при выполнении задачи {job.id}: {str(e)}")
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    try:
+        completed = finish_job(job, deferred)
+    except LeaseLost as e:
+        logger.warning(f"{str(e)}: итог не записан")
+        return job
+    publish(job.mailing_id, 'job', {'job_id': job.id, 'kind': job.kind, 'status': job.status,
+                                    'attempt_number': job.attempt_number, 'processed': job.processed,
+                                    'error': job.error})
+    if completed:
+        reset_progress([job.mailing_id])
+        publish_progress(job.mailing_id, 'status', status='completed')
+    return job
+
+
+def finish_job(job, deferred=()):
+    """Сохраняет итог задачи, ставит повтор для deferred и завершает рассылку, если это был последний
+    невыполненный шард прохода.
+
+    Итог пишется, только пока задача за этим воркером (иначе LeaseLost). Строка рассылки блокируется:
+    из шардов, закончившихся одновременно на разных узлах, незавершённые шарды не увидит только
+    последний, и рассылку завершит ровно он. Пока хоть один шард в ошибке, рассылка не завершается —
+    её можно поставить в очередь снова, и отправлен будет только остаток.
+    """
+    with transaction.atomic():
+        mailing = Mailing.objects.select_for_update().get(pk=job.mailing_id)
+        if not leased(job).update(status=job.status, error=job.error, finished_at=job.finished_at):
+            raise LeaseLost(job)
+        if deferred:
+            schedule_retry(job.mailing_id, deferred, job.attempt_number + 1)
+        if job.kind != 'send' or job.status != 'done' or run_shards(mailing.pk).exclude(status='done').exists():
+            return False
+        mailing.complete_sending()
+    logger.info(f"Все шарды рассылки {mailing.pk} выполнены, рассылка завершена")
+    return True
+
+
+def process_next_job(worker):
+    job = claim_job(worker)
+    if job is not None:
+        run_job(job)
+    return job
@@ -0,0 +1,1068 @@
+import copy
+import csv
+import io
+import json
+import smtplib
+import socket
+import threading
+import time
+from datetime import timedelta
+from email import message_from_bytes
+from importlib.util import find_spec
+from unittest import mock, skipUnless
+
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.http import Http404
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import CustomUser
+from .importers import ERROR_FIELDS, import_recipients, import_suppressions
+from . import statistics
+from .cache import statistics_cache
+from .delivery import (AttemptBuffer, EmailFactory, PreparedEmail, compose_email, deliver_parallel, is_transient,
+                       send_chunk, send_mailing)
+from .events import broadcaster, event_stream
+from .models import (DeliveryAttempt, DeliveryJob, DeliveryState, Mailing, MailingCounters, Message, RateLimitBucket,
+                     Recipient, SuppressedAddress)
+from .pagination import decode_cursor, encode_cursor
+from .personalization import CompiledMessage, CompiledTemplate, compiled_message
+from .partitions import (DEFAULT_PARTITION, add_months, attempt_partitions, create_partition,
+                         ensure_attempt_partitions, month_start, prune_attempt_partitions)
+from .ratelimit import DatabaseRateLimiter, LocalRateLimiter, RateLimit, check_limits
+from .scheduler import launch_due_mailings, run_scheduler_once, seconds_until_next_start
+from .tasks import (LeaseLost, claim_job, heartbeat, keep_alive, process_next_job, requeue_stale_jobs, run_job,
+                    send_mailing_task)
+
+
+# Тесты, которые чистят кэш статистики: по умолчанию это файловый кэш проекта (BASE_DIR/cache),
+# его очистка стёрла бы кэш разработчика и мешала бы параллельным запускам
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'mailing-tests'}}
+
+
+class QueryBudgetTests(TestCase):
+    """Число запросов на страницу не должно зависеть от числа строк."""
+    rows = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='pass')
+        cls.manager = CustomUser.objects.create_user(username='manager', email='manager@example.com',
+                                                     password='pass', role='manager')
+        now = timezone.now()
+        for i in range(cls.rows):
+            message = Message.objects.create(subject=f'Subject {i}', body='Body', owner=cls.user)
+            recipient = Recipient.objects.create(email=f'r{i}@example.com', full_name=f'R {i}', comment='',
+                                                 owner=cls.user)
+            mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                             message=message, owner=cls.user)
+            mailing.recipients.add(recipient)
+        cls.mailing = mailing
+
+    def get_with_budget(self, user, url, budget):
+        self.client.force_login(user)
+        # Сессия и пользователь — 2 запроса, остальное — сама страница
+        with self.assertNumQueries(2 + budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_mailing_list(self):
+        response = self.get_with_budget(self.user, reverse('mailing:mailing_list'), 1)
+        self.assertContains(response, 'Subject 0')
+
+    def test_mailing_list_manager(self):
+        self.get_with_budget(self.manager, reverse('mailing:mailing_list'), 1)
+
+    def test_recipient_list(self):
+        self.get_with_budget(self.user, reverse('mailing:recipient_list'), 1)
+
+    def test_message_list(self):
+        self.get_with_budget(self.user, reverse('mailing:message_list'), 1)
+
+    def test_json_lists(self):
+        # Все json_fields уже в выборке: ни одной догрузки отложенных полей на строку
+        for name in ('mailing_list', 'recipient_list', 'message_list'):
+            with self.subTest(name):
+                response = self.get_with_budget(self.user, f"{reverse(f'mailing:{name}')}?format=json", 1)
+                self.assertEqual(len(response.json()['results']), self.rows)
+
+    def test_mailing_detail(self):
+        # рассылка с сообщением, последняя задача отправки, число и превью получателей
+        self.get_with_budget(self.user, reverse('mailing:mailing_detail', args=[self.mailing.pk]), 4)
+
+    def test_recipient_detail(self):
+        recipient = Recipient.objects.first()
+        self.get_with_budget(self.user, reverse('mailing:recipient_detail', args=[recipient.pk]), 1)
+
+    def test_message_detail(self):
+        message = Message.objects.first()
+        self.get_with_budget(self.user, reverse('mailing:message_detail', args=[message.pk]), 1)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = CustomUser.objects.create_user(username='manager', email='manager@example.com',
+                                                     password='pass', role='manager')
+        owners = [CustomUser.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pass')
+                  for i in range(2)]
+        # Владельцы вперемешку с получателями без владельца: порядок id не совпадает с порядком страниц
+        for i in range(7):
+            Recipient.objects.create(email=f'r{i}@example.com', full_name=f'R {i}', comment='',
+                                     owner=[owners[1], None, owners[0]][i % 3])
+        cls.expected = list(Recipient.objects.order_by(F('owner_id').asc(nulls_last=True), 'pk')
+                            .values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def test_cursor_round_trip(self):
+        for owner_id in (5, None):
+            cursor = encode_cursor(Recipient(pk=42, owner_id=owner_id))
+            self.assertEqual(decode_cursor(cursor), (owner_id, 42))
+        with self.assertRaises(Http404):
+            decode_cursor('broken')
+
+    def test_json_pages_cover_all_rows_with_null_owners_last(self):
+        url = reverse('mailing:recipient_list')
+        seen, after = [], None
+        while True:
+            params = {'format': 'json', 'page_size': 2, **({'after': after} if after else {})}
+            data = self.client.get(url, params).json()
+            self.assertLessEqual(len(data['results']), 2)
+            seen.extend(row['id'] for row in data['results'])
+            after = data['next']
+            if after is None:
+                break
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(set(data['results'][-1]), {'id', 'email', 'full_name', 'comment', 'owner_id'})
+        self.assertIsNone(data['results'][-1]['owner_id'])
+
+    def test_load_more_link_keeps_page_size(self):
+        response = self.client.get(reverse('mailing:recipient_list'), {'page_size': 3}, HTTP_HX_REQUEST='true')
+        cursor = encode_cursor(Recipient.objects.get(pk=self.expected[2]))
+        self.assertContains(response, f'href="?after={cursor}&amp;page_size=3"')
+        self.assertEqual(len(response.context['object_list']), 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ProgressTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='pass')
+        cls.other = CustomUser.objects.create_user(username='other', email='other@example.com', password='pass')
+        now = timezone.now()
+        cls.mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1), owner=cls.user,
+                                             message=Message.objects.create(subject='Subject', body='Body'))
+        cls.mailing.recipients.add(*Recipient.objects.bulk_create([
+            Recipient(email=f'r{i}@example.com', full_name=f'R {i}', comment='') for i in range(3)
+        ]))
+
+    def setUp(self):
+        # Воркер кладёт снимки хода отправки в кэш, а id рассылок в тестах повторяются
+        statistics_cache().clear()
+
+    def test_progress_from_counters(self):
+        url = reverse('mailing:mailing_progress', args=[self.mailing.pk])
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).json()['total'], 0)
+
+        send_mailing(self.mailing)
+        # Только сессия и пользователь: снимок счётчиков положил в кэш воркер, публикуя события
+        with self.assertNumQueries(2):
+            progress = self.client.get(url).json()
+        self.assertEqual((progress['total'], progress['sent'], progress['failed'], progress['pending']), (3, 3, 0, 0))
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StatisticsCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pass')
+                     for i in range(2)]
+        cls.managers = [CustomUser.objects.create_user(username=f'manager{i}', email=f'manager{i}@example.com',
+                                                       password='pass', role='manager')
+                        for i in range(2)]
+        now = timezone.now()
+        cls.mailings = []
+        for i, user in enumerate(cls.users):
+            mailing = Mailing.objects.create(subject=f'Mailing {i}', start_datetime=now,
+                                             end_datetime=now + timedelta(days=1), owner=user,
+                                             message=Message.objects.create(subject='Subject', body='Body'))
+            MailingCounters.increment(mailing.pk, successful=i + 1)
+            cls.mailings.append(mailing)
+        cls.recipient = Recipient.objects.create(email='r@example.com', full_name='R', comment='')
+
+    def setUp(self):
+        statistics_cache().clear()
+
+    def get_statistics(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse('mailing:mailing_statistics'))
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def test_users_do_not_share_cached_statistics(self):
+        for user, mailing in zip(self.users, self.mailings):
+            context = self.get_statistics(user)
+            self.assertEqual([row['mailing_id'] for row in context['statistics']], [mailing.pk])
+            self.assertEqual(context['summary']['mailings'], 1)
+
+    def test_managers_share_all_owners_scope(self):
+        context = self.get_statistics(self.managers[0])
+        self.assertEqual(context['summary']['successful_attempts'], 3)
+        self.client.force_login(self.managers[1])
+        # Сессия и пользователь: статистику построил первый менеджер
+        with self.assertNumQueries(2):
+            self.client.get(reverse('mailing:mailing_statistics'))
+
+    def test_flush_invalidates_owner_and_manager_statistics(self):
+        owner, manager = self.users[0], self.managers[0]
+        self.assertEqual(self.get_statistics(owner)['summary']['successful_attempts'], 1)
+        self.assertEqual(self.get_statistics(manager)['summary']['successful_attempts'], 3)
+
+        with AttemptBuffer() as buffer:
+            buffer.add(self.mailings[0], self.recipient, 'success')
+
+        self.assertEqual(self.get_statistics(owner)['summary']['successful_attempts'], 2)
+        self.assertEqual(self.get_statistics(manager)['summary']['successful_attempts'], 4)
+
+
+class RecipientImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='pass')
+        Recipient.objects.create(email='old@example.com', full_name='Old', comment='', owner=cls.user)
+
+    def test_import_upserts_and_reports_errors(self):
+        lines = io.StringIO(
+            "email,full_name,comment\n"
+            "new@example.com,New,first\n"
+            "OLD@example.com,Renamed,updated\n"
+            "not-an-email,Broken,\n"
+            "new@example.com,New again,dup\n"
+        )
+        errors = io.StringIO()
+        writer = csv.DictWriter(errors, fieldnames=ERROR_FIELDS)
+        result = import_recipients(lines, self.user, batch_size=2, error_writer=writer)
+
+        self.assertEqual((result.rows, result.failed), (4, 1))
+        self.assertEqual(Recipient.objects.count(), 2)
+        self.assertEqual(Recipient.objects.get(email='old@example.com').full_name, 'Renamed')
+        self.assertEqual(Recipient.objects.get(email='new@example.com').full_name, 'New again')
+        self.assertIn('not-an-email', errors.getvalue())
+
+    def test_import_does_not_touch_other_owners_recipients(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='pass')
+        Recipient.objects.create(email='bob@example.com', full_name='Bob', comment='', owner=other)
+        lines = io.StringIO("email,full_name,comment\nbob@example.com,Hijacked,\nnew@example.com,New,\n")
+        errors = io.StringIO()
+        result = import_recipients(lines, self.user, error_writer=csv.DictWriter(errors, fieldnames=ERROR_FIELDS))
+
+        self.assertEqual((result.imported, result.failed), (1, 1))
+        bob = Recipient.objects.get(email='bob@example.com')
+        self.assertEqual((bob.full_name, bob.owner), ('Bob', other))
+        self.assertEqual(Recipient.objects.get(email='new@example.com').owner, self.user)
+        self.assertIn('bob@example.com', errors.getvalue())
+
+    def test_reimport_matches_stored_email_case_insensitively(self):
+        Recipient.objects.create(email='Ann@Example.com', full_name='Ann', comment='', owner=self.user)
+        result = import_recipients(io.StringIO("email,full_name,comment\nANN@example.COM,Anna,updated\n"), self.user)
+
+        self.assertEqual((result.imported, result.failed), (1, 0))
+        ann = Recipient.objects.get(email__iexact='ann@example.com')
+        self.assertEqual((ann.email, ann.full_name, ann.comment), ('Ann@Example.com', 'Anna', 'updated'))
+
+    def test_broken_file_is_a_form_error(self):
+        self.client.force_login(self.user)
+        # Поле длиннее csv.field_size_limit() — csv.Error при разборе
+        upload = SimpleUploadedFile('r.csv', b'email,full_name\nx@example.com,' + b'a' * 200_000 + b'\n')
+        response = self.client.post(reverse('mailing:recipient_import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('файл не разбирается как CSV', ' '.join(response.context['form'].errors['file']))
+
+        result = import_recipients(io.StringIO("email,full_name\nnul@example.com,N\x00ul\n"), self.user)
+        self.assertEqual((result.imported, result.failed), (0, 1))
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pass')
+                     for i in range(2)]
+        cls.manager = CustomUser.objects.create_user(username='manager', email='manager@example.com',
+                                                     password='pass', role='manager')
+        cls.now = timezone.now()
+        recipient = Recipient.objects.create(email='r@example.com', full_name='R', comment='')
+        cls.mailings = []
+        for user in cls.users:
+            mailing = Mailing.objects.create(start_datetime=cls.now, end_datetime=cls.now + timedelta(days=1),
+                                             owner=user, message=Message.objects.create(subject='Subject', body='Body'))
+            DeliveryAttempt.objects.bulk_create([
+                DeliveryAttempt(mailing=mailing, recipient=recipient, status=status,
+                                attempt_time=cls.now - timedelta(days=days))
+                for status, days in [('success', 0), ('failed', 0), ('success', 3)]
+            ])
+            cls.mailings.append(mailing)
+
+    def export(self, user, **params):
+        self.client.force_login(user)
+        response = self.client.get(reverse('mailing:export_attempts'), {'format': 'ndjson', **params})
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_user_exports_only_own_attempts(self):
+        owner, other = self.users
+        rows = self.export(owner, owner=other.pk)
+        self.assertEqual({row['mailing_id'] for row in rows}, {self.mailings[0].pk})
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(self.export(owner, mailing=self.mailings[1].pk), [])
+
+    def test_manager_exports_any_owner(self):
+        self.assertEqual(len(self.export(self.manager)), 6)
+        rows = self.export(self.manager, owner=self.users[1].pk)
+        self.assertEqual({row['owner_email'] for row in rows}, {'user1@example.com'})
+
+    def test_status_and_time_filters(self):
+        owner = self.users[0]
+        self.assertEqual([row['status'] for row in self.export(owner, status='failed')], ['failed'])
+        since = (self.now - timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.export(owner, since=since)), 2)
+        self.assertEqual(len(self.export(owner, until=since, status='success')), 1)
+        self.client.force_login(owner)
+        self.assertEqual(self.client.get(reverse('mailing:export_attempts'), {'since': 'yesterday'}).status_code, 400)
+
+
+class SchedulerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='pass')
+        cls.message = Message.objects.create(subject='Subject', body='Body', owner=cls.user)
+
+    def create_mailing(self, start, end, status='created'):
+        return Mailing.objects.create(start_datetime=start, end_datetime=end, status=status,
+                                      message=self.message, owner=self.user)
+
+    def test_launches_due_and_completes_expired(self):
+        now = timezone.now()
+        due = self.create_mailing(now - timedelta(minutes=1), now + timedelta(days=1))
+        future = self.create_mailing(now + timedelta(hours=1), now + timedelta(days=1))
+        expired = self.create_mailing(now - timedelta(days=2), now - timedelta(days=1), status='started')
+
+        launched, changed = run_scheduler_once(now)
+
+        self.assertEqual(launched, [due.pk])
+        self.assertEqual(changed, {'started_to_completed': 1, 'created_to_completed': 0})
+        self.assertEqual(Mailing.objects.get(pk=due.pk).status, 'started')
+        self.assertEqual(Mailing.objects.get(pk=future.pk).status, 'created')
+        self.assertEqual(Mailing.objects.get(pk=expired.pk).status, 'completed')
+        self.assertTrue(DeliveryJob.objects.filter(mailing=due, status='queued').exists())
+        self.assertEqual(run_scheduler_once(now)[0], [])
+        self.assertAlmostEqual(seconds_until_next_start(now), 3600, delta=1)
+
+    def test_due_mailings_over_limit_wait_for_next_pass(self):
+        now = timezone.now()
+        due = [self.create_mailing(now - timedelta(minutes=3 - i), now + timedelta(days=1)) for i in range(3)]
+
+        with mock.patch('mailing.scheduler.launch_due_mailings', lambda now: launch_due_mailings(now, limit=2)):
+            self.assertEqual(run_scheduler_once(now)[0], [due[0].pk, due[1].pk])
+            # Сверх лимита рассылка не запущена без задачи, а ждёт следующего прохода
+            self.assertEqual(Mailing.objects.get(pk=due[2].pk).status, 'created')
+            self.assertEqual(run_scheduler_once(now)[0], [due[2].pk])
+
+        for mailing in due:
+            self.assertEqual(Mailing.objects.get(pk=mailing.pk).status, 'started')
+            self.assertTrue(DeliveryJob.objects.filter(mailing=mailing).exists())
+
+
+class MailingStatusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.message = Message.objects.create(subject='Subject', body='Body')
+
+    def test_refresh_statuses_in_bulk(self):
+        now = timezone.now()
+        hour = timedelta(hours=1)
+        for start, end, status in [
+            (now - hour, now + hour, 'created'),
+            (now - 2 * hour, now - hour, 'started'),
+            (now - 2 * hour, now - hour, 'created'),
+            (now + hour, now + 2 * hour, 'created'),
+        ]:
+            Mailing.objects.create(start_datetime=start, end_datetime=end, status=status, message=self.message)
+
+        with self.assertNumQueries(2):
+            changed = Mailing.refresh_statuses(now)
+
+        self.assertEqual(changed, {'started_to_completed': 1, 'created_to_completed': 1})
+        self.assertEqual(Mailing.objects.filter(status='completed').count(), 2)
+        # Наступившую рассылку запускает только планировщик вместе с задачей отправки
+        self.assertEqual(Mailing.objects.filter(status='created').count(), 2)
+
+    def test_mailing_with_active_shards_is_not_completed(self):
+        now = timezone.now()
+        mailing = Mailing.objects.create(start_datetime=now - timedelta(hours=2), end_datetime=now - timedelta(hours=1),
+                                         status='started', message=self.message)
+        job = DeliveryJob.objects.create(mailing=mailing, status='running')
+        # Срок вышел, но шард ещё отправляет: рассылку завершит он сам (finish_job)
+        self.assertEqual(Mailing.refresh_statuses(now)['started_to_completed'], 0)
+        DeliveryJob.objects.filter(pk=job.pk).update(status='failed')
+        self.assertEqual(Mailing.refresh_statuses(now)['started_to_completed'], 1)
+
+
+class RateLimiterTests(TestCase):
+    limits = {'host:smtp.example.com': RateLimit(rate=10, burst=5), 'owner:1': RateLimit(rate=1, burst=3)}
+
+    def check_limiter(self, limiter):
+        # Выдаём не больше, чем осталось в самом пустом ведре, и списываем со всех
+        self.assertEqual(limiter.acquire(self.limits, 10), (3, 0))
+        granted, delay = limiter.acquire(self.limits, 1)
+        self.assertEqual(granted, 0)
+        self.assertAlmostEqual(delay, 1, delta=0.1)
+
+    def test_database_limiter(self):
+        self.check_limiter(DatabaseRateLimiter())
+        self.assertAlmostEqual(RateLimitBucket.objects.get(key='host:smtp.example.com').tokens, 2, delta=0.1)
+
+    def test_local_limiter(self):
+        self.check_limiter(LocalRateLimiter())
+
+    def test_limits_that_never_grant_a_token_are_rejected(self):
+        for value in [(0, 5), (-1, 5), (10, 0.5), (10,)]:
+            with self.subTest(value), override_settings(MAILING_HOST_RATE_LIMIT=value):
+                with self.assertRaises(ImproperlyConfigured):
+                    check_limits()
+        with override_settings(MAILING_HOST_RATE_LIMIT=(10, 1), MAILING_OWNER_RATE_LIMIT=None):
+            check_limits()
+
+
+class FlakyBackend(EmailBackend):
+    """grey@ — greylisting (450), bad@ — несуществующий ящик (550), остальные доставляются."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            address = message.to[0]
+            if address.startswith('grey@'):
+                raise smtplib.SMTPRecipientsRefused({address: (450, b'Greylisted, try again later')})
+            if address.startswith('bad@'):
+                raise smtplib.SMTPRecipientsRefused({address: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='mailing.tests.FlakyBackend', MAILING_RETRY_MAX_ATTEMPTS=2)
+class RetryTests(TestCase):
+    def test_error_classification(self):
+        self.assertTrue(is_transient(smtplib.SMTPResponseException(421, b'Too many connections')))
+        self.assertTrue(is_transient(smtplib.SMTPServerDisconnected()))
+        self.assertTrue(is_transient(TimeoutError()))
+        self.assertFalse(is_transient(smtplib.SMTPDataError(554, b'Rejected')))
+        self.assertFalse(is_transient(smtplib.SMTPNotSupportedError()))
+        self.assertFalse(is_transient(ValueError()))
+
+    def test_transient_failures_are_retried_in_background(self):
+        now = timezone.now()
+        mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                         message=Message.objects.create(subject='Subject', body='Body'))
+        recipients = {name: Recipient.objects.create(email=f'{name}@example.com', full_name=name, comment='')
+                      for name in ('ok', 'grey', 'bad')}
+        mailing.recipients.add(*recipients.values())
+
+        [job] = send_mailing_task(mailing.pk)
+        run_job(job)
+
+        self.assertEqual(
+            set(DeliveryAttempt.objects.values_list('recipient__email', 'status', 'attempt_number')),
+            {('ok@example.com', 'success', 1), ('grey@example.com', 'deferred', 1), ('bad@example.com', 'failed', 1)},
+        )
+        retry = DeliveryJob.objects.get(kind='retry')
+        self.assertEqual((retry.status, retry.recipient_ids, retry.attempt_number),
+                         ('queued', [recipients['grey'].pk], 2))
+        self.assertGreater(retry.run_after, now)
+        # Повтор ещё не наступил — воркер его не берёт
+        self.assertIsNone(claim_job('test'))
+
+        DeliveryJob.objects.filter(pk=retry.pk).update(run_after=timezone.now())
+        self.assertEqual(process_next_job('test').pk, retry.pk)
+        # Попытки кончились: временная ошибка становится окончательной, новый повтор не ставится
+        self.assertTrue(DeliveryAttempt.objects.filter(recipient=recipients['grey'], status='failed',
+                                                       attempt_number=2).exists())
+        self.assertEqual(DeliveryJob.objects.filter(kind='retry').count(), 1)
+        counters = MailingCounters.objects.get(mailing=mailing)
+        self.assertEqual((counters.successful_attempts, counters.failed_attempts), (1, 2))
+
+
+class DroppingBackend(EmailBackend):
+    """Сервер разрывает первое соединение на втором письме. Письма по соединениям — в opened."""
+    opened = []
+
+    def open(self):
+        self.sent = []
+        self.opened.append(self.sent)
+        return True
+
+    def send_messages(self, messages):
+        if len(self.opened) == 1 and len(self.sent) == 1:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        self.sent.extend(message.to[0] for message in messages)
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='mailing.tests.DroppingBackend', MAILING_BATCH_SIZE=10)
+class ReconnectTests(TestCase):
+    @mock.patch.object(DroppingBackend, 'opened', [])
+    def test_chunk_continues_on_new_connection_after_disconnect(self):
+        now = timezone.now()
+        mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                         message=Message.objects.create(subject='Subject', body='Body'))
+        mailing.recipients.add(*Recipient.objects.bulk_create([
+            Recipient(email=f'r{i}@example.com', full_name=f'R {i}', comment='') for i in range(4)
+        ]))
+
+        send_mailing(mailing)
+
+        # Письмо, на котором оборвалось соединение, и остаток пачки ушли по одному новому соединению
+        self.assertEqual(DroppingBackend.opened,
+                         [['r0@example.com'], ['r1@example.com', 'r2@example.com', 'r3@example.com']])
+        self.assertEqual(DeliveryAttempt.objects.filter(mailing=mailing, status='success').count(), 4)
+
+
+class CountingBackend(EmailBackend):
+    """Считает одновременно открытые соединения (пик — в peak), письмо «уходит» за 20 мс."""
+    lock = threading.Lock()
+    connections = 0
+    peak = 0
+    sent = []
+
+    def open(self):
+        with self.lock:
+            CountingBackend.connections += 1
+            CountingBackend.peak = max(CountingBackend.peak, CountingBackend.connections)
+        return True
+
+    def close(self):
+        with self.lock:
+            CountingBackend.connections -= 1
+
+    def send_messages(self, messages):
+        time.sleep(0.02)
+        with self.lock:
+            self.sent.extend(message.to[0] for message in messages)
+        return len(messages)
+
+
+@override_settings(EMAIL_BACKEND='mailing.tests.CountingBackend', MAILING_BATCH_SIZE=1, MAILING_MAX_CONNECTIONS=4,
+                   MAILING_GLOBAL_MAX_CONNECTIONS=2)
+class ParallelDeliveryTests(TestCase):
+    @mock.patch('mailing.delivery._connection_slots', None)
+    @mock.patch.multiple(CountingBackend, connections=0, peak=0, sent=[])
+    def test_connections_stay_within_global_limit(self):
+        message = Message.objects.create(subject='Subject', body='Body')
+        recipients = Recipient.objects.bulk_create([
+            Recipient(email=f'r{i}@example.com', full_name=f'R {i}', comment='') for i in range(8)
+        ])
+
+        results = [result for chunk in deliver_parallel(message, recipients) for result in chunk]
+
+        # Потоков пула 4, но соединений одновременно ровно столько, сколько разрешает общий лимит
+        self.assertEqual(CountingBackend.peak, 2)
+        self.assertEqual(CountingBackend.connections, 0)
+        emails = [recipient.email for recipient in recipients]
+        self.assertEqual(sorted(CountingBackend.sent), emails)
+        self.assertEqual([(recipient.email, status) for recipient, status, response in results],
+                         [(email, 'success') for email in emails])
+
+
+@override_settings(EMAIL_BACKEND='mailing.tests.FlakyBackend')
+class SuppressionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.message = Message.objects.create(subject='Subject', body='Body')
+        cls.recipients = {email: Recipient.objects.create(email=email, full_name=email, comment='')
+                          for email in ('ok@example.com', 'bad@example.com', 'Ok@Example.com')}
+
+    def create_mailing(self, *emails):
+        now = timezone.now()
+        mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1), message=self.message)
+        mailing.recipients.add(*(self.recipients[email] for email in emails))
+        return mailing
+
+    def test_hard_bounce_suppresses_address_for_next_mailings(self):
+        send_mailing(self.create_mailing('bad@example.com'))
+        self.assertEqual(SuppressedAddress.objects.get().reason, 'bounce')
+        mail.outbox.clear()
+
+        mailing = self.create_mailing('ok@example.com', 'bad@example.com', 'Ok@Example.com')
+        send_mailing(mailing)
+
+        # Заблокированный адрес и второй экземпляр ok@ (другой регистр) не отправляются
+        self.assertEqual([email.to[0] for email in mail.outbox], ['ok@example.com'])
+        self.assertEqual(
+            sorted(DeliveryAttempt.objects.filter(mailing=mailing).values_list('recipient__email', 'status')),
+            [('Ok@Example.com', 'suppressed'), ('bad@example.com', 'suppressed'), ('ok@example.com', 'success')],
+        )
+
+    def test_bulk_import(self):
+        lines = io.StringIO("email,reason,comment\nA@Example.com,unsubscribe,\nb@example.com,,\nbroken,,\n")
+        result = import_suppressions(lines, reason='complaint')
+        self.assertEqual((result.imported, result.failed), (2, 1))
+        self.assertEqual(dict(SuppressedAddress.objects.values_list('email', 'reason')),
+                         {'a@example.com': 'unsubscribe', 'b@example.com': 'complaint'})
+
+
+class PersonalizationTests(TestCase):
+    def test_compiled_template(self):
+        template = CompiledTemplate("Hi {{ full_name }}, {literal} {{email}}")
+        self.assertEqual(template.render({'full_name': 'Ann', 'email': 'ann@example.com'}),
+                         "Hi Ann, {literal} ann@example.com")
+        with self.assertRaises(ValidationError):
+            CompiledTemplate("{{ password }}")
+
+    def test_cache_follows_message_updates(self):
+        message = Message.objects.create(subject='Hi {{ full_name }}', body='Body')
+        compiled = compiled_message(message)
+        self.assertIs(compiled_message(message), compiled)
+        message.subject = 'Hello {{ full_name }}'
+        message.save()
+        self.assertEqual(compiled_message(message).subject.render({'full_name': 'Ann'}), 'Hello Ann')
+
+    def test_mailing_is_personalized(self):
+        now = timezone.now()
+        message = Message.objects.create(subject='{{ full_name }}, news', body='Sent to {{ email }}')
+        mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1), message=message)
+        mailing.recipients.add(Recipient.objects.create(email='ann@example.com', full_name='Ann', comment=''))
+        send_mailing(mailing)
+        self.assertEqual((mail.outbox[0].subject, mail.outbox[0].body), ('Ann, news', 'Sent to ann@example.com'))
+
+
+class MultipartEmailTests(TestCase):
+    def test_static_mime_is_built_once(self):
+        factory = EmailFactory(CompiledMessage('News', 'Plain text', '<p>Привет!</p>'))
+        first = factory.build(Recipient(email='a@example.com')).message()
+        second = factory.build(Recipient(email='b@example.com')).message()
+
+        # Части письма общие, свои у каждого только To, Date и Message-ID
+        self.assertIs(first.get_payload(), second.get_payload())
+        self.assertEqual((first['To'], second['To']), ('a@example.com', 'b@example.com'))
+        self.assertNotEqual(first['Message-ID'], second['Message-ID'])
+        self.assertIsNone(factory.mime['To'])
+        self.assertIsNone(factory.mime['Date'])
+        self.assertIn(b'text/html', second.as_bytes())
+        # Байты из кэша совпадают с полной сериализацией письма с теми же заголовками
+        full = copy.deepcopy(factory.mime)
+        for name, value in second.headers:
+            full[name] = value
+        self.assertEqual(second.as_bytes(linesep='\r\n'), full.as_bytes(linesep='\r\n'))
+        parsed = message_from_bytes(second.as_bytes(linesep='\r\n'))
+        self.assertEqual([parsed[name] for name in ('To', 'Date', 'Message-ID')],
+                         [second['To'], second['Date'], second['Message-ID']])
+
+    def test_idn_recipient_matches_dynamic_path(self):
+        factory = EmailFactory(CompiledMessage('News', 'Plain text', ''))
+        for to in ('user@пример.рф', 'Иван Петров <user@пример.рф>'):
+            with self.subTest(to):
+                static = PreparedEmail(factory, to, 'Mon, 19 Oct 2026 10:00:00 -0000').message()
+                dynamic = compose_email('News', 'Plain text', '', [to]).message()
+                self.assertEqual(static['To'], dynamic['To'])
+                self.assertIn(b'xn--e1afmkfd.xn--p1ai', static.as_bytes())
+
+    def test_chunk_shares_fresh_date(self):
+        factory = EmailFactory(CompiledMessage('News', 'Plain text', ''))
+        with mock.patch('mailing.delivery.formatdate', return_value='Mon, 19 Oct 2026 10:00:00 -0000'):
+            send_chunk(EmailBackend(), factory, [Recipient(email='a@example.com'), Recipient(email='b@example.com')])
+        self.assertEqual([email.message()['Date'] for email in mail.outbox], ['Mon, 19 Oct 2026 10:00:00 -0000'] * 2)
+
+    def test_personalized_html_is_escaped(self):
+        factory = EmailFactory(CompiledMessage('Hi {{ full_name }}', 'Text', '<b>{{ full_name }}</b>'))
+        email = factory.build(Recipient(email='a@example.com', full_name='<Ann>'))
+        self.assertEqual(email.subject, 'Hi <Ann>')
+        self.assertEqual(email.alternatives[0][0], '<b>&lt;Ann&gt;</b>')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DeliveryEventTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='pass')
+        now = timezone.now()
+        cls.mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1), owner=cls.user,
+                                             message=Message.objects.create(subject='Subject', body='Body'))
+        cls.mailing.recipients.add(*Recipient.objects.bulk_create([
+            Recipient(email=f'r{i}@example.com', full_name=f'R {i}', comment='') for i in range(3)
+        ]))
+
+    def setUp(self):
+        statistics_cache().clear()
+
+    @override_settings(MAILING_BATCH_SIZE=2)
+    def test_send_mailing_publishes_batches_and_status(self):
+        with mock.patch('mailing.delivery.publish') as publish:
+            send_mailing(self.mailing)
+        events = [(call.args[1], call.args[2]) for call in publish.call_args_list]
+        self.assertEqual([event for event, data in events], ['run_started', 'batch', 'batch', 'status'])
+        self.assertEqual(sum(data.get('success', 0) for event, data in events), 3)
+        self.assertEqual(events[-1][1]['status'], 'completed')
+        self.assertEqual(events[-1][1]['progress']['sent'], 3)
+
+    # Слушатель NOTIFY не запускаем: событие раздаём так же, как он, а его соединение мешало бы удалить тестовую БД
+    @mock.patch('mailing.events.start_listener')
+    @mock.patch.object(broadcaster, 'subscribers', {})
+    async def test_stream_pushes_published_events(self, start_listener):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('mailing:mailing_events', args=[self.mailing.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'event: progress\n'))
+
+        broadcaster.dispatch(json.dumps({'mailing_id': self.mailing.pk + 1, 'event': 'batch', 'data': {}}))
+        broadcaster.dispatch(json.dumps({'mailing_id': self.mailing.pk, 'event': 'status',
+                                         'data': {'status': 'completed'}}))
+        self.assertEqual(await anext(chunks), b'event: status\ndata: {"status": "completed"}\n\n')
+
+    @mock.patch('mailing.events.start_listener')
+    async def test_closed_stream_unsubscribes(self, start_listener):
+        stream = event_stream(self.mailing.pk, {'total': 0})
+        await anext(stream)
+        self.assertIn(self.mailing.pk, broadcaster.subscribers)
+        await stream.aclose()
+        self.assertNotIn(self.mailing.pk, broadcaster.subscribers)
+
+    def test_stream_requires_asgi(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('mailing:mailing_events', args=[self.mailing.pk])).status_code, 204)
+
+
+class ResumableRunTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                             message=Message.objects.create(subject='Subject', body='Body'))
+        cls.recipients = Recipient.objects.bulk_create([
+            Recipient(email=f'r{i}@example.com', full_name=f'R {i}', comment='') for i in range(4)
+        ])
+        cls.mailing.recipients.add(*cls.recipients)
+
+    def test_restart_sends_only_remaining_recipients(self):
+        # Первый запуск упал после двух записанных писем
+        DeliveryState.objects.bulk_create([
+            DeliveryState(mailing=self.mailing, recipient=recipient, status='success')
+            for recipient in self.recipients[:2]
+        ])
+
+        send_mailing(self.mailing)
+
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), ['r2@example.com', 'r3@example.com'])
+        self.assertEqual(DeliveryState.objects.filter(mailing=self.mailing, status='success').count(), 4)
+        send_mailing(self.mailing)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_stale_running_job_is_requeued(self):
+        job = DeliveryJob.objects.create(mailing=self.mailing, status='running',
+                                         heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(timeout=600), 1)
+        self.assertEqual(DeliveryJob.objects.get(pk=job.pk).status, 'queued')
+
+    def test_requeued_job_is_fenced_from_old_worker(self):
+        DeliveryJob.objects.create(mailing=self.mailing, recipients_total=4)
+        stale = claim_job('node-1')
+        DeliveryJob.objects.filter(pk=stale.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        requeue_stale_jobs(timeout=600)
+        claim_job('node-2')
+
+        # Прежний воркер жив: его отметка не проходит, отправка и запись итога не начинаются
+        with self.assertRaises(LeaseLost):
+            heartbeat(stale)
+        run_job(stale)
+        self.assertEqual(mail.outbox, [])
+        job = DeliveryJob.objects.get(pk=stale.pk)
+        self.assertEqual((job.status, job.worker), ('running', 'node-2'))
+
+    @mock.patch('mailing.tasks.heartbeat')
+    def test_lease_is_renewed_while_sending(self, heartbeat):
+        # Между пачками (медленный SMTP, ожидание лимита) аренду продлевает фоновый поток
+        beat = threading.Event()
+        heartbeat.side_effect = lambda job: beat.set()
+        job = DeliveryJob(pk=1)
+        with keep_alive(job, interval=0.01):
+            self.assertTrue(beat.wait(5))
+        heartbeat.assert_called_with(job)
+
+
+@override_settings(MAILING_SHARD_SIZE=2)
+class ShardedDeliveryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                             message=Message.objects.create(subject='Subject', body='Body'))
+        cls.recipients = Recipient.objects.bulk_create([
+            Recipient(email=f'r{i}@example.com', full_name=f'R {i}', comment='') for i in range(5)
+        ])
+        cls.mailing.recipients.add(*cls.recipients)
+
+    def test_mailing_completes_after_last_shard(self):
+        jobs = send_mailing_task(self.mailing.pk)
+        ids = [recipient.pk for recipient in self.recipients]
+        self.assertEqual([(job.range_start, job.range_end, job.recipients_total) for job in jobs],
+                         [(None, ids[2], 2), (ids[2], ids[4], 2), (ids[4], None, 1)])
+        # Пока шарды в работе, повторная постановка в очередь новых не создаёт
+        self.assertEqual(len(send_mailing_task(self.mailing.pk)), 3)
+
+        for worker in ('node-1', 'node-2'):
+            process_next_job(worker)
+            self.mailing.refresh_from_db()
+            self.assertEqual(self.mailing.status, 'created')
+        process_next_job('node-3')
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, 'completed')
+
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), [r.email for r in self.recipients])
+        shards = statistics.current_progress(self.mailing.pk)['shards']
+        self.assertEqual((shards['total'], shards['done'], shards['processed']), (3, 3, 5))
+
+    @skipUnless(connection.features.has_select_for_update, "Блокировки строк нет в SQLite")
+    def test_enqueue_locks_mailing_before_checking_active_shards(self):
+        # Две одновременные постановки в очередь не должны обе не найти шардов и создать по набору
+        with CaptureQueriesContext(connection) as queries:
+            send_mailing_task(self.mailing.pk)
+        sql = [query['sql'] for query in queries]
+        locked = next(i for i, query in enumerate(sql) if 'FOR UPDATE' in query and '"mailing_mailing"' in query)
+        checked = next(i for i, query in enumerate(sql) if '"mailing_deliveryjob"' in query)
+        self.assertLess(locked, checked)
+
+    def test_failed_shard_blocks_completion_until_resent(self):
+        send_mailing_task(self.mailing.pk)
+        with mock.patch('mailing.tasks.send_mailing', side_effect=RuntimeError('SMTP down')):
+            self.assertEqual(process_next_job('node-1').status, 'failed')
+        while process_next_job('node-2'):
+            pass
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, 'created')
+
+        # Новый проход досылает только получателей упавшего шарда
+        mail.outbox.clear()
+        send_mailing_task(self.mailing.pk)
+        while process_next_job('node-2'):
+            pass
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, 'completed')
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), ['r0@example.com', 'r1@example.com'])
+
+    def test_disabled_mailing_stops_sending(self):
+        manager = CustomUser.objects.create_user(username='manager', email='manager@example.com',
+                                                 password='pass', role='manager')
+        send_mailing_task(self.mailing.pk)
+        running = claim_job('node-1')
+        self.client.force_login(manager)
+        self.client.get(reverse('mailing:disable_mailing', args=[self.mailing.pk]))
+
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, 'completed')
+        self.assertEqual(set(DeliveryJob.objects.values_list('status', flat=True)), {'canceled'})
+        # Очередь пуста, а воркер, уже взявший шард, не отправляет ни одного письма
+        self.assertIsNone(claim_job('node-2'))
+        run_job(running)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(DeliveryJob.objects.get(pk=running.pk).status, 'canceled')
+
+
+class FlakySMTPHandler:
+    """Обработчик aiosmtpd с теми же отказами, что у FlakyBackend."""
+
+    def __init__(self):
+        self.delivered = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('grey@'):
+            return '450 Greylisted, try again later'
+        if address.startswith('bad@'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered.extend(envelope.rcpt_tos)
+        return '250 OK'
+
+
+@skipUnless(find_spec('aiosmtplib') and find_spec('aiosmtpd'), "Нужны aiosmtplib и aiosmtpd")
+class AsyncEngineTests(TestCase):
+    def setUp(self):
+        from aiosmtpd.controller import Controller
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.handler = FlakySMTPHandler()
+        controller = Controller(self.handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        self.addCleanup(controller.stop)
+        settings = override_settings(
+            MAILING_DELIVERY_ENGINE='mailing.async_delivery.deliver_async', MAILING_BATCH_SIZE=2,
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=port, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+            EMAIL_USE_SSL=False, EMAIL_USE_TLS=False, DEFAULT_FROM_EMAIL='noreply@example.com',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_send_mailing_through_asyncio_engine(self):
+        now = timezone.now()
+        mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                         message=Message.objects.create(subject='Hi {{ full_name }}', body='Body'))
+        mailing.recipients.add(*(Recipient.objects.create(email=f'{name}@example.com', full_name=name, comment='')
+                                 for name in ('ok', 'ok2', 'ok3', 'grey', 'bad')))
+
+        deferred = send_mailing(mailing)
+
+        self.assertEqual(sorted(self.handler.delivered), ['ok2@example.com', 'ok3@example.com', 'ok@example.com'])
+        self.assertEqual(
+            sorted(DeliveryAttempt.objects.filter(mailing=mailing).values_list('recipient__email', 'status')),
+            [('bad@example.com', 'failed'), ('grey@example.com', 'deferred'), ('ok2@example.com', 'success'),
+             ('ok3@example.com', 'success'), ('ok@example.com', 'success')],
+        )
+        self.assertEqual(len(deferred), 1)
+        # Отказ 550 от aiosmtplib классифицируется так же, как от smtplib
+        self.assertEqual(SuppressedAddress.objects.get().email, 'bad@example.com')
+
+    @override_settings(MAILING_BATCH_SIZE=1, MAILING_GLOBAL_MAX_CONNECTIONS=2)
+    @mock.patch('mailing.delivery._connection_slots', None)
+    def test_global_connection_limit(self):
+        import aiosmtplib
+
+        opened, peak = set(), []
+
+        class CountingSMTP(aiosmtplib.SMTP):
+            async def connect(self, *args, **kwargs):
+                response = await super().connect(*args, **kwargs)
+                opened.add(self)
+                peak.append(len(opened))
+                return response
+
+            def close(self):
+                opened.discard(self)
+                super().close()
+
+        now = timezone.now()
+        mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                         message=Message.objects.create(subject='Subject', body='Body'))
+        emails = [f'ok{i}@example.com' for i in range(8)]
+        mailing.recipients.add(*(Recipient.objects.create(email=email, full_name=email, comment='')
+                                 for email in emails))
+        with mock.patch.object(aiosmtplib, 'SMTP', CountingSMTP):
+            send_mailing(mailing)
+
+        # Сессий по умолчанию до MAILING_ASYNC_MAX_CONNECTIONS, но соединений не больше общего лимита
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(sorted(self.handler.delivered), sorted(emails))
+        self.assertEqual(DeliveryAttempt.objects.filter(mailing=mailing, status='success').count(), len(emails))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Проверка планов запросов — только для PostgreSQL")
+class IndexUsageTests(TestCase):
+    """На данных рабочего объёма планировщик сам (без запрета seq scan) выбирает индексы горячих запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='pass')
+        message = Message.objects.create(subject='Subject', body='Body', owner=cls.owner)
+        Recipient.objects.bulk_create([
+            Recipient(email=f'r{i}@example.com', full_name=f'R {i}', comment='',
+                      owner=cls.owner if i % 10 == 0 else other)
+            for i in range(5000)
+        ])
+        now = timezone.now()
+        # Почти все рассылки давно завершены, наступивших среди созданных — единицы
+        Mailing.objects.bulk_create([
+            Mailing(start_datetime=now + timedelta(days=i % 30 - 365 * (i % 20 != 0)), end_datetime=now,
+                    status='created' if i % 20 == 0 else 'completed', message=message, owner=other)
+            for i in range(5000)
+        ])
+        cls.mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                             message=message, owner=cls.owner)
+        with connection.cursor() as cursor:
+            # Попытки за сутки с лишним, по секунде: 100 тыс. строк в порядке времени, как их пишет отправка
+            cursor.execute(
+                "INSERT INTO mailing_deliveryattempt "
+                "(mailing_id, recipient_id, status, attempt_number, attempt_time, server_response) "
+                "SELECT %s, ids[1 + n %% array_length(ids, 1)], "
+                "CASE WHEN n %% 50 = 0 THEN 'failed' ELSE 'success' END, 1, %s - n * interval '1 second', '' "
+                "FROM generate_series(99999, 0, -1) AS n, (SELECT array_agg(id) AS ids FROM mailing_recipient) r",
+                [cls.mailing.pk, now],
+            )
+            # Отложенные проверки внешних ключей — один раз здесь, а не в конце каждого теста
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, *index_names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), plan)
+
+    def test_attempts_by_mailing_and_status(self):
+        # На секционированной таблице в плане видны индексы секций: <секция>_mailing_id_status_idx
+        self.assertUsesIndex(DeliveryAttempt.objects.filter(mailing=self.mailing, status='failed'),
+                             'attempt_mailing_status', '_mailing_id_status_idx')
+
+    def test_attempts_by_time_range(self):
+        now = timezone.now()
+        self.assertUsesIndex(DeliveryAttempt.objects.filter(attempt_time__gte=now - timedelta(hours=1)),
+                             'attempt_time_brin', '_attempt_time_idx')
+
+    def test_due_mailings(self):
+        self.assertUsesIndex(Mailing.objects.filter(status='created', start_datetime__lte=timezone.now()),
+                             'mailing_status_start')
+
+    def test_recipient_keyset_page(self):
+        queryset = Recipient.objects.filter(owner=self.owner, pk__gt=100).order_by('owner_id', 'pk')[:24]
+        self.assertUsesIndex(queryset, 'recipient_owner_id')
+
+
+@skipUnless(connection.vendor == 'postgresql', "Секционирование — только PostgreSQL")
+class AttemptPartitionTests(TestCase):
+    def test_create_and_prune_monthly_partitions(self):
+        now = timezone.now()
+        created = ensure_attempt_partitions(months_ahead=1, now=now)
+        self.assertEqual(len(created), 2)
+        old_month = add_months(month_start(now), -14)
+        with connection.cursor() as cursor:
+            old_partition = create_partition(cursor, old_month)
+
+        self.assertIn(old_partition, [name for month, name in attempt_partitions()])
+        self.assertEqual(prune_attempt_partitions(keep_months=12, now=now), [old_partition])
+        self.assertNotIn(old_partition, [name for month, name in attempt_partitions()])
+
+    def test_partition_takes_over_rows_from_default(self):
+        month = add_months(month_start(timezone.now()), 6)
+        now = timezone.now()
+        mailing = Mailing.objects.create(start_datetime=now, end_datetime=now + timedelta(days=1),
+                                         message=Message.objects.create(subject='Subject', body='Body'))
+        recipient = Recipient.objects.create(email='r@example.com', full_name='R', comment='')
+        # Секцию на этот месяц не создали вовремя — попытка попала в DEFAULT
+        DeliveryAttempt.objects.create(mailing=mailing, recipient=recipient, status='success',
+                                       attempt_time=month + timedelta(days=3))
+
+        with connection.cursor() as cursor:
+            name = create_partition(cursor, month)
+            cursor.execute(f'SELECT count(*) FROM "{name}"')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute(f'SELECT count(*) FROM "{DEFAULT_PARTITION}"')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(DeliveryAttempt.objects.filter(mailing=mailing).count(), 1)
+
+    def test_partition_errors_do_not_stop_scheduler(self):
+        with mock.patch('mailing.partitions.create_partition', side_effect=DatabaseError('boom')), \
+                self.assertLogs('mailing.partitions', 'ERROR'):
+            self.assertEqual(ensure_attempt_partitions(), [])
+            run_scheduler_once()
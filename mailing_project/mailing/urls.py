@@ -4,7 +4,7 @@ from .views import (
     MessageListView, MessageDetailView, MessageCreateView, MessageUpdateView, MessageDeleteView,
     mailing_statistics_list, RecipientListView, RecipientDetailView, RecipientCreateView,
     RecipientUpdateView, RecipientDeleteView, mailing_statistics_detail, SendMailingView, MailingHomeView,
-    disable_mailing
+    disable_mailing, RecipientImportView, export_attempts, mailing_progress, mailing_events
 )
 
 app_name = 'mailing'
@@ -18,6 +18,7 @@ urlpatterns = [
     path('mailing/recipients/', RecipientListView.as_view(), name='recipient_list'),
     path('mailing/recipients/<int:pk>/', RecipientDetailView.as_view(), name='recipient_detail'),
     path('mailing/recipients/create/', RecipientCreateView.as_view(), name='recipient_create'),
+    path('mailing/recipients/import/', RecipientImportView.as_view(), name='recipient_import'),
     path('mailing/recipients/<int:pk>/update/', RecipientUpdateView.as_view(), name='recipient_update'),
     path('mailing/recipients/<int:pk>/delete/', RecipientDeleteView.as_view(), name='recipient_delete'),
     path('messages/', MessageListView.as_view(), name='message_list'),
@@ -26,8 +27,11 @@ urlpatterns = [
     path('messages/<int:pk>/update/', MessageUpdateView.as_view(), name='message_update'),
     path('messages/<int:pk>/delete/', MessageDeleteView.as_view(), name='message_delete'),
     path('mailing/<int:pk>/send/', SendMailingView.as_view(), name='send_mailing'),
+    path('mailing/<int:pk>/progress/', mailing_progress, name='mailing_progress'),
+    path('mailing/<int:pk>/events/', mailing_events, name='mailing_events'),
     path('mailing/<int:mailing_id>/statistics/', mailing_statistics_detail, name='mailing_statistics_detail'),
     path('mailing/statistics/', mailing_statistics_list, name='mailing_statistics'),
+    path('mailing/statistics/export/', export_attempts, name='export_attempts'),
     path('mailing/<int:mailing_id>/disable/', disable_mailing, name='disable_mailing'),
     path('', MailingHomeView.as_view(), name='home'),
 ]
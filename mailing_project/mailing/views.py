@@ -7,12 +7,21 @@ from django.contrib import messages
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
-# Исправляем импорт cache_page
-from django.views.decorators.cache import cache_page
-from .models import Recipient, Message, Mailing, DeliveryAttempt, MailingStatistics, send_mailing
-from .forms import RecipientForm, MessageForm, MailingForm
+from .models import Recipient, Message, Mailing
+from . import statistics
+from .cache import get_or_build
+from .events import event_stream, publish, release_connections
+from .pagination import KeysetPaginationMixin
+from .tasks import cancel_mailing, send_mailing_task
+from .forms import RecipientForm, MessageForm, MailingForm, RecipientImportForm
+from .importers import import_recipients
+from .exports import EXPORT_FORMATS, attempts_for_export, export_lines, parse_time
 from django.urls import reverse_lazy
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+import io
 import os
 from dotenv import load_dotenv
 
@@ -20,30 +29,55 @@ load_dotenv()
 
 
 class UserIsOwnerMixin(UserPassesTestMixin):
+    def get_object(self, queryset=None):
+        # Объект уже загружен в test_func — не запрашиваем его второй раз в get/post
+        if not hasattr(self, '_object'):
+            self._object = super().get_object(queryset)
+        return self._object
+
     def test_func(self):
         if self.request.user.is_manager():
             return True
         obj = self.get_object()
-        return obj.owner == self.request.user if hasattr(obj, 'owner') else False
+        return obj.owner_id == self.request.user.pk if hasattr(obj, 'owner_id') else False
 
     def handle_no_permission(self):
         messages.error(self.request, "У вас нет прав для выполнения этого действия.")
         return redirect('mailing:home')
 
 
-class MailingListView(LoginRequiredMixin, ListView):
+class MailingListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Mailing
     template_name = 'mailing/mailing_list.html'
+    partial_template_name = 'mailing/includes/mailing_cards.html'
+    json_fields = ('id', 'subject', 'status', 'start_datetime', 'end_datetime', 'message_id', 'owner_id')
 
     def get_queryset(self):
+        queryset = (Mailing.objects
+                    .select_related('message')
+                    .only('subject', 'status', 'start_datetime', 'end_datetime', 'owner', 'message__subject'))
         if self.request.user.is_manager():
-            return Mailing.objects.all()
-        return Mailing.objects.filter(owner=self.request.user)
+            return queryset
+        return queryset.filter(owner=self.request.user)
 
 
 class MailingDetailView(LoginRequiredMixin, UserIsOwnerMixin, DetailView):
     model = Mailing
     template_name = 'mailing/mailing_detail.html'
+    recipients_preview_size = 20
+
+    def get_queryset(self):
+        return Mailing.objects.select_related('message')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['delivery_job'] = self.object.jobs.order_by('-created_at').first()
+        recipients_count = self.object.recipients.count()
+        recipients_preview = list(self.object.recipients.only('full_name')[:self.recipients_preview_size])
+        context['recipients_count'] = recipients_count
+        context['recipients_preview'] = recipients_preview
+        context['recipients_more'] = recipients_count - len(recipients_preview)
+        return context
 
 
 class MailingCreateView(LoginRequiredMixin, CreateView):
@@ -70,14 +104,18 @@ class MailingDeleteView(LoginRequiredMixin, UserIsOwnerMixin, DeleteView):
     success_url = reverse_lazy('mailing:mailing_list')
 
 
-class RecipientListView(LoginRequiredMixin, ListView):
+class RecipientListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Recipient
     template_name = 'mailing/recipient_list.html'
+    partial_template_name = 'mailing/includes/recipient_cards.html'
+    json_fields = ('id', 'email', 'full_name', 'comment', 'owner_id')
 
     def get_queryset(self):
+        # Поля карточек и json_fields: отложенное поле догружалось бы отдельным запросом на каждую строку
+        queryset = Recipient.objects.only('email', 'full_name', 'comment', 'owner')
         if self.request.user.is_manager():
-            return Recipient.objects.all()
-        return Recipient.objects.filter(owner=self.request.user)
+            return queryset
+        return queryset.filter(owner=self.request.user)
 
 
 class RecipientDetailView(LoginRequiredMixin, UserIsOwnerMixin, DetailView):
@@ -96,6 +134,28 @@ class RecipientCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+class RecipientImportView(LoginRequiredMixin, View):
+    template_name = 'mailing/recipient_import.html'
+
+    def get(self, request):
+        return render(request, self.template_name, {'form': RecipientImportForm()})
+
+    def post(self, request):
+        form = RecipientImportForm(request.POST, request.FILES)
+        result = None
+        if form.is_valid():
+            # Загруженный файл читается построчно, без декодирования целиком в память
+            lines = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            try:
+                result = import_recipients(lines, request.user)
+                messages.success(request, f"Импортировано получателей: {result.imported}, ошибок: {result.failed}")
+            except ValidationError as e:
+                form.add_error('file', e)
+            except UnicodeDecodeError:
+                form.add_error('file', "Файл должен быть в кодировке UTF-8")
+        return render(request, self.template_name, {'form': form, 'result': result})
+
+
 class RecipientUpdateView(LoginRequiredMixin, UserIsOwnerMixin, UpdateView):
     model = Recipient
     form_class = RecipientForm
@@ -109,14 +169,17 @@ class RecipientDeleteView(LoginRequiredMixin, UserIsOwnerMixin, DeleteView):
     success_url = reverse_lazy('mailing:recipient_list')
 
 
-class MessageListView(LoginRequiredMixin, ListView):
+class MessageListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Message
     template_name = 'mailing/message_list.html'
+    partial_template_name = 'mailing/includes/message_cards.html'
+    json_fields = ('id', 'subject', 'body', 'created_at', 'owner_id')
 
     def get_queryset(self):
+        queryset = Message.objects.only('subject', 'body', 'created_at', 'owner')
         if self.request.user.is_manager():
-            return Message.objects.all()
-        return Message.objects.filter(owner=self.request.user)
+            return queryset
+        return queryset.filter(owner=self.request.user)
 
 
 class MessageDetailView(LoginRequiredMixin, UserIsOwnerMixin, DetailView):
@@ -153,28 +216,31 @@ class MailingHomeView(LoginRequiredMixin, TemplateView):
 
 
 class SendMailingView(LoginRequiredMixin, UserIsOwnerMixin, View):
+    def get_object(self):
+        return get_object_or_404(Mailing, pk=self.kwargs['pk'])
+
     def post(self, request, pk):
-        mailing = get_object_or_404(Mailing, pk=pk)
+        mailing = self.get_object()
         try:
-            send_mailing(mailing)
-            messages.success(request, f"Рассылка {mailing.subject} запущена!")
+            send_mailing_task(mailing.pk)
+            messages.success(request, f"Рассылка {mailing.subject} поставлена в очередь на отправку!")
         except Exception as e:
             messages.error(request, f"Ошибка при запуске рассылки: {str(e)}")
         return redirect('mailing:mailing_detail', pk=pk)
 
 
-@cache_page(300)
 def mailing_statistics_list(request):
     if not request.user.is_authenticated:
         return redirect('users:login')
-    if request.user.is_manager():
-        statistics = MailingStatistics.objects.all().order_by("-sent_at")
-    else:
-        statistics = MailingStatistics.objects.filter(mailing__owner=request.user).order_by("-sent_at")
-    return render(request, "mailing/statistics_list.html", {"statistics": statistics})
+    user = request.user
+    context = get_or_build(user, 'list', lambda: {
+        "statistics": statistics.mailing_totals(user),
+        "summary": statistics.owner_summary(user),
+        "owners": statistics.owner_totals(user) if user.is_manager() else [],
+    })
+    return render(request, "mailing/statistics_list.html", context)
 
 
-@cache_page(300)
 def mailing_statistics_detail(request, mailing_id):
     if not request.user.is_authenticated:
         return redirect('users:login')
@@ -182,13 +248,68 @@ def mailing_statistics_detail(request, mailing_id):
     if not request.user.is_manager() and mailing.owner != request.user:
         messages.error(request, "У вас нет прав для просмотра этой статистики.")
         return redirect('mailing:mailing_list')
-    statistics = MailingStatistics.objects.filter(mailing=mailing)
-    attempts = DeliveryAttempt.objects.filter(mailing=mailing)
-    return render(request, 'mailing/statistics_detail.html', {
-        'mailing': mailing,
-        'statistics': statistics,
-        'attempts': attempts,
-    })
+    context = get_or_build(request.user, 'detail', lambda: {
+        'statistics': statistics.mailing_summary(mailing),
+        'daily': statistics.daily_totals(mailing),
+        'attempts': statistics.recent_attempts(mailing),
+    }, mailing.pk)
+    return render(request, 'mailing/statistics_detail.html', {'mailing': mailing, **context})
+
+
+@login_required
+def export_attempts(request):
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest("Формат выгрузки: csv или ndjson")
+    try:
+        mailing_id = int(request.GET['mailing']) if request.GET.get('mailing') else None
+        owner_id = int(request.GET['owner']) if request.GET.get('owner') else None
+        since = parse_time(request.GET['since']) if request.GET.get('since') else None
+        until = parse_time(request.GET['until']) if request.GET.get('until') else None
+    except ValueError:
+        return HttpResponseBadRequest("Некорректные параметры выгрузки")
+    if not request.user.is_manager():
+        # Пользователь выгружает только историю своих рассылок
+        owner_id = request.user.pk
+
+    queryset = attempts_for_export(mailing_id=mailing_id, owner_id=owner_id, status=request.GET.get('status'),
+                                   since=since, until=until)
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export_lines(queryset, export_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="delivery_attempts.{export_format}"'
+    return response
+
+
+@login_required
+def mailing_progress(request, pk):
+    progress = statistics.mailing_progress(pk, request.user)
+    if progress is None:
+        raise Http404("Рассылка не найдена")
+    response = JsonResponse(progress)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@login_required
+async def mailing_events(request, pk):
+    """SSE-поток событий доставки рассылки (server-sent events); работает только под ASGI (config.asgi).
+
+    БД опрашивается один раз при подключении, дальше события приходят из подписки процесса.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI поток занял бы воркер целиком; 204 говорит EventSource не переподключаться,
+        # и страница переходит на опрос mailing/<pk>/progress/
+        return HttpResponse(status=204)
+    user = await request.auser()
+    progress = await sync_to_async(statistics.mailing_progress)(pk, user)
+    await sync_to_async(release_connections)()
+    if progress is None:
+        raise Http404("Рассылка не найдена")
+    response = StreamingHttpResponse(event_stream(pk, progress), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-store'
+    # nginx не должен буферизовать поток
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -197,7 +318,8 @@ def disable_mailing(request, mailing_id):
         messages.error(request, "У вас нет прав для отключения рассылок.")
         return redirect('mailing:mailing_list')
     mailing = get_object_or_404(Mailing, id=mailing_id)
-    mailing.status = 'completed'
-    mailing.save()
+    # Задачи в очереди отменяются, иначе воркеры продолжили бы отправку отключённой рассылки
+    cancel_mailing(mailing.pk)
+    publish(mailing.pk, 'status', {'status': 'completed'})
     messages.success(request, f"Рассылка {mailing.subject} отключена.")
     return redirect('mailing:mailing_list')
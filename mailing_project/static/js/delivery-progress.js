@@ -0,0 +1,111 @@
+// Ход отправки рассылки: события из mailing/<pk>/events/ (SSE), а без них — опрос mailing/<pk>/progress/,
+// пока есть неотправленные получатели
+document.querySelectorAll('[data-progress-url]').forEach(function (widget) {
+    const interval = parseInt(widget.dataset.progressInterval || '2000', 10);
+    const bar = widget.querySelector('.progress-bar');
+    const text = widget.querySelector('[data-progress-text]');
+    const log = widget.querySelector('[data-progress-events]');
+    const logSize = 10;
+
+    function formatEta(seconds) {
+        if (seconds === null) {
+            return '—';
+        }
+        const minutes = Math.floor(seconds / 60);
+        return minutes > 0 ? minutes + ' мин ' + (seconds % 60) + ' с' : seconds + ' с';
+    }
+
+    function render(progress) {
+        const done = progress.sent + progress.failed + progress.suppressed;
+        const percent = progress.total ? Math.round(done * 100 / progress.total) : 0;
+        bar.style.width = percent + '%';
+        bar.textContent = percent + '%';
+        text.textContent = 'Отправлено: ' + progress.sent + ', ошибок: ' + progress.failed
+            + ', пропущено: ' + progress.suppressed + ', осталось: ' + progress.pending
+            + ', скорость: ' + (progress.rate_per_second === null ? '—' : progress.rate_per_second + ' писем/с')
+            + ', осталось времени: ' + formatEta(progress.eta_seconds)
+            + (progress.shards && progress.shards.total > 1
+                ? ', шардов выполнено: ' + progress.shards.done + ' из ' + progress.shards.total
+                  + (progress.shards.failed ? ' (с ошибкой: ' + progress.shards.failed + ')' : '')
+                : '');
+    }
+
+    function describe(event, data) {
+        switch (event) {
+            case 'run_started':
+                return 'Попытка ' + data.attempt_number + ': получателей ' + data.recipients
+                    + ', пропущено ' + data.skipped;
+            case 'batch':
+                return 'Пачка: успешно ' + (data.success || 0) + ', ошибок ' + (data.failed || 0)
+                    + ', отложено ' + (data.deferred || 0) + ', пропущено ' + (data.suppressed || 0);
+            case 'status':
+                return 'Статус рассылки: ' + data.status;
+            case 'retry_scheduled':
+                return 'Повтор ' + data.attempt_number + ' для ' + data.recipients + ' получателей в ' + data.run_after;
+            case 'job':
+                return 'Задача ' + data.job_id + ': ' + data.status + ', обработано ' + data.processed
+                    + (data.error ? ' (' + data.error + ')' : '');
+        }
+        return event;
+    }
+
+    function addToLog(line) {
+        if (!log) {
+            return;
+        }
+        const item = document.createElement('li');
+        item.textContent = new Date().toLocaleTimeString() + ' — ' + line;
+        log.prepend(item);
+        while (log.children.length > logSize) {
+            log.lastChild.remove();
+        }
+    }
+
+    function poll() {
+        fetch(widget.dataset.progressUrl, {headers: {'Accept': 'application/json'}})
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                return response.json();
+            })
+            .then(function (progress) {
+                render(progress);
+                // Рассылку ещё не запускали или всё отправлено — дальше не опрашиваем
+                if (progress.total && progress.pending > 0) {
+                    setTimeout(poll, interval);
+                }
+            })
+            .catch(function () {
+                setTimeout(poll, interval * 5);
+            });
+    }
+
+    function listen() {
+        const source = new EventSource(widget.dataset.eventsUrl);
+        source.addEventListener('progress', function (message) {
+            render(JSON.parse(message.data));
+        });
+        ['run_started', 'batch', 'status', 'retry_scheduled', 'job'].forEach(function (event) {
+            source.addEventListener(event, function (message) {
+                const data = JSON.parse(message.data);
+                if (data.progress) {
+                    render(data.progress);
+                }
+                addToLog(describe(event, data));
+            });
+        });
+        source.onerror = function () {
+            // Сервер без ASGI отвечает 204 и поток закрывается насовсем; обрыв сети EventSource переживает сам
+            if (source.readyState === EventSource.CLOSED) {
+                poll();
+            }
+        };
+    }
+
+    if (widget.dataset.eventsUrl && window.EventSource) {
+        listen();
+    } else {
+        poll();
+    }
+});
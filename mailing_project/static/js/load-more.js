@@ -0,0 +1,21 @@
+// Кнопка «Показать ещё»: дозагружает следующую страницу карточек без перезагрузки
+document.addEventListener('click', function (event) {
+    const link = event.target.closest('[data-load-more]');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    const container = link.closest('[data-load-more-container]');
+    link.classList.add('disabled');
+    fetch(link.href, {headers: {'HX-Request': 'true'}})
+        .then(function (response) {
+            return response.text();
+        })
+        .then(function (html) {
+            container.insertAdjacentHTML('beforebegin', html);
+            container.remove();
+        })
+        .catch(function () {
+            link.classList.remove('disabled');
+        });
+});